@@ -0,0 +1,128 @@
+import numpy as np
+from datetime import date, timedelta
+from typing import Dict, Any, Iterable, Sequence
+
+# Rolling windows (in days) reported for every habit
+ROLLING_WINDOWS = (7, 30, 90, 365)
+
+def build_completion_matrix(
+    habit_ids: Sequence[str],
+    completions: Iterable[Dict[str, Any]],
+    end_date: date,
+    days: int
+) -> np.ndarray:
+    """Build a habits x days boolean matrix; the last column is end_date"""
+    matrix = np.zeros((len(habit_ids), max(days, 0)), dtype=bool)
+    if not len(habit_ids) or days <= 0:
+        return matrix
+    
+    row_by_habit = {habit_id: row for row, habit_id in enumerate(habit_ids)}
+    rows = []
+    dates = []
+    for completion in completions:
+        row = row_by_habit.get(completion["habit_id"])
+        if row is not None and completion["completed"]:
+            rows.append(row)
+            dates.append(completion["date"])
+    if not rows:
+        return matrix
+    
+    start = np.datetime64(end_date - timedelta(days=days - 1), "D")
+    columns = (np.array(dates, dtype="datetime64[D]") - start).astype(np.int64)
+    rows = np.array(rows, dtype=np.int64)
+    in_window = (columns >= 0) & (columns < days)
+    matrix[rows[in_window], columns[in_window]] = True
+    return matrix
+
+def current_streaks(matrix: np.ndarray) -> np.ndarray:
+    """Current streak per habit, counting from yesterday when the last day is not completed"""
+    if matrix.shape[1] == 0:
+        return np.zeros(matrix.shape[0], dtype=np.int64)
+    
+    reversed_days = matrix[:, ::-1].astype(np.int64)
+    including_today = np.cumprod(reversed_days, axis=1).sum(axis=1)
+    from_yesterday = np.cumprod(reversed_days[:, 1:], axis=1).sum(axis=1)
+    return np.where(matrix[:, -1], including_today, from_yesterday)
+
+def longest_streaks(matrix: np.ndarray) -> np.ndarray:
+    """Longest run of consecutive completed days per habit within the matrix"""
+    habits, days = matrix.shape
+    longest = np.zeros(habits, dtype=np.int64)
+    if days == 0:
+        return longest
+    
+    padded = np.zeros((habits, days + 2), dtype=np.int8)
+    padded[:, 1:-1] = matrix
+    edges = np.diff(padded, axis=1)
+    # Runs start at +1 edges and end at -1 edges; row-major order keeps them paired
+    start_rows, start_columns = np.nonzero(edges == 1)
+    _, end_columns = np.nonzero(edges == -1)
+    np.maximum.at(longest, start_rows, end_columns - start_columns)
+    return longest
+
+def rolling_completion_counts(
+    matrix: np.ndarray,
+    windows: Sequence[int] = ROLLING_WINDOWS
+) -> Dict[int, np.ndarray]:
+    """Completed days per habit over each trailing window that fits in the matrix"""
+    return {
+        window: matrix[:, -window:].sum(axis=1)
+        for window in windows
+        if 0 < window <= matrix.shape[1]
+    }
+
+def weekday_completion_rates(matrix: np.ndarray, end_date: date) -> np.ndarray:
+    """Completion rate percentage per habit for each weekday (Sunday = 0, as in NotificationSettings.days)"""
+    habits, days = matrix.shape
+    if days == 0:
+        return np.zeros((habits, 7))
+    
+    start = np.datetime64(end_date - timedelta(days=days - 1), "D")
+    day_numbers = (start + np.arange(days)).astype(np.int64)
+    # 1970-01-01 was a Thursday
+    weekdays = (day_numbers + 4) % 7
+    weekday_columns = (weekdays[:, None] == np.arange(7)).astype(np.int64)
+    
+    completed = matrix.astype(np.int64) @ weekday_columns
+    totals = weekday_columns.sum(axis=0)
+    return np.divide(
+        completed * 100.0, totals,
+        out=np.zeros((habits, 7)), where=totals > 0
+    )
+
+def compute_habit_stats(
+    habit_ids: Sequence[str],
+    completions: Iterable[Dict[str, Any]],
+    end_date: date = None,
+    days: int = 365,
+    windows: Sequence[int] = ROLLING_WINDOWS
+) -> Dict[str, Dict[str, Any]]:
+    """Compute streaks, rolling rates and weekday rates for every habit at once"""
+    if end_date is None:
+        end_date = date.today()
+    
+    matrix = build_completion_matrix(habit_ids, completions, end_date, days)
+    current = current_streaks(matrix).tolist()
+    longest = longest_streaks(matrix).tolist()
+    counts = {
+        window: window_counts.tolist()
+        for window, window_counts in rolling_completion_counts(matrix, windows).items()
+    }
+    weekday_rates = np.round(weekday_completion_rates(matrix, end_date), 1).tolist()
+    completed_today = matrix[:, -1].tolist() if days > 0 else [False] * len(habit_ids)
+    
+    stats = {}
+    for row, habit_id in enumerate(habit_ids):
+        rolling_rates = {
+            window: round((window_counts[row] / window) * 100, 1)
+            for window, window_counts in counts.items()
+        }
+        stats[habit_id] = {
+            "current_streak": current[row],
+            "longest_streak": longest[row],
+            "completion_rate": rolling_rates.get(30, 0.0),
+            "rolling_rates": rolling_rates,
+            "weekday_rates": weekday_rates[row],
+            "completed_today": completed_today[row]
+        }
+    return stats
@@ -2,11 +2,16 @@ from fastapi import HTTPException, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import jwt
 import os
+import asyncio
+import hashlib
 from datetime import datetime, timedelta
-from typing import Optional
-import httpx
+from typing import Optional, TYPE_CHECKING
 from models import User, UserCreate
 from database import Database
+from cache import TTLCache
+
+if TYPE_CHECKING:
+    import httpx
 
 # JWT Configuration
 SECRET_KEY = os.environ.get("JWT_SECRET", "your-secret-key-change-in-production")
@@ -15,6 +20,32 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60  # 30 days
 
 security = HTTPBearer()
 
+# Google endpoints, overridable to point at a local stub server
+GOOGLE_TOKENINFO_URL = os.environ.get("GOOGLE_TOKENINFO_URL", "https://oauth2.googleapis.com/tokeninfo")
+GOOGLE_USERINFO_URL = os.environ.get("GOOGLE_USERINFO_URL", "https://www.googleapis.com/oauth2/v2/userinfo")
+
+# App-lifetime client so logins reuse pooled TCP/TLS connections to Google; httpx loads on first login
+_http_client: Optional["httpx.AsyncClient"] = None
+
+# Verified Google profiles by token hash, so repeated logins with one token skip the network
+google_token_cache = TTLCache(maxsize=10000, ttl=300)
+
+def get_http_client() -> "httpx.AsyncClient":
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -36,45 +67,58 @@ async def verify_google_token(token: str) -> dict:
             "picture": "https://via.placeholder.com/150"
         }
     
+    token_hash = hashlib.sha256(token.encode()).hexdigest()
+    cached_user = google_token_cache.get(token_hash)
+    if cached_user is not None:
+        return dict(cached_user)
+    
+    import httpx
+    
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"https://oauth2.googleapis.com/tokeninfo?access_token={token}"
-            )
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Invalid Google token"
-                )
-            
-            token_info = response.json()
-            
-            # Get user profile information
-            profile_response = await client.get(
-                "https://www.googleapis.com/oauth2/v2/userinfo",
-                headers={"Authorization": f"Bearer {token}"}
-            )
-            
-            if profile_response.status_code != 200:
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Could not fetch user profile"
-                )
-            
-            profile_data = profile_response.json()
-            
-            return {
-                "google_id": profile_data.get("id"),
-                "email": profile_data.get("email"),
-                "name": profile_data.get("name"),
-                "picture": profile_data.get("picture")
-            }
-            
+        client = get_http_client()
+        # The token check and the profile fetch are independent, so issue them together
+        response, profile_response = await asyncio.gather(
+            client.get(GOOGLE_TOKENINFO_URL, params={"access_token": token}),
+            client.get(GOOGLE_USERINFO_URL, headers={"Authorization": f"Bearer {token}"})
+        )
     except httpx.RequestError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not verify Google token"
         )
+    
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid Google token"
+        )
+    
+    token_info = response.json()
+    
+    if profile_response.status_code != 200:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not fetch user profile"
+        )
+    
+    profile_data = profile_response.json()
+    
+    google_user = {
+        "google_id": profile_data.get("id"),
+        "email": profile_data.get("email"),
+        "name": profile_data.get("name"),
+        "picture": profile_data.get("picture")
+    }
+    
+    # Never cache past the token's own expiry
+    try:
+        ttl = min(google_token_cache.ttl, float(token_info.get("expires_in", google_token_cache.ttl)))
+    except (TypeError, ValueError):
+        ttl = google_token_cache.ttl
+    if ttl > 0:
+        google_token_cache.set(token_hash, google_user, ttl)
+    
+    return dict(google_user)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
     """Get current user from JWT token"""
@@ -92,14 +136,18 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             detail="Could not validate credentials"
         )
     
-    user = await Database.get_user_by_id(user_id)
+    user = Database.user_cache.get(user_id)
     if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found"
-        )
+        user = await Database.get_user_by_id(user_id)
+        if user is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="User not found"
+            )
+        Database.user_cache.set(user_id, user)
     
-    return user
+    # Hand out a copy so request handlers cannot modify the cached document
+    return dict(user)
 
 async def get_or_create_user(google_user_data: dict) -> dict:
     """Get existing user or create new one from Google data"""
@@ -107,6 +155,7 @@ async def get_or_create_user(google_user_data: dict) -> dict:
     existing_user = await Database.get_user_by_google_id(google_user_data["google_id"])
     
     if existing_user:
+        Database.user_cache.delete(existing_user["_id"])
         # Update user info in case it changed
         await Database.update_user(existing_user["_id"], {
             "name": google_user_data["name"],
@@ -121,4 +170,5 @@ async def get_or_create_user(google_user_data: dict) -> dict:
     user_dict["_id"] = str(user_dict.pop("id", ""))
     
     new_user = await Database.create_user(user_dict)
+    Database.user_cache.delete(new_user["_id"])
     return new_user
\ No newline at end of file
@@ -0,0 +1,89 @@
+"""Measure CPU spent building the /api/habits response: Pydantic models vs. dicts + orjson.
+
+Usage: python benchmarks/habit_list.py [--habits 50 500] [--iterations 200]
+
+Only response construction and serialization are timed; the database is not involved.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import compute_habit_stats
+from models import HabitResponse
+from server import FastJSONResponse, NOTIFICATION_DEFAULTS, app
+from utils import format_habit_stats
+
+def make_habits(count: int):
+    """Habit documents as the projection returns them, plus a year of analytics stats"""
+    today = date.today()
+    habits = [
+        {
+            "_id": str(uuid.uuid4()),
+            "user_id": "benchmark",
+            "name": f"Habit {index}",
+            "category": random.choice(["health", "fitness", "learning"]),
+            "notification": {"enabled": True, "time": "08:30", "days": [1, 2, 3, 4, 5]},
+            "created_at": datetime.utcnow(),
+        }
+        for index in range(count)
+    ]
+    completions = [
+        {"habit_id": habit["_id"], "date": (today - timedelta(days=offset)).isoformat(), "completed": True}
+        for habit in habits
+        for offset in range(365)
+        if random.random() < 0.6
+    ]
+    stats = compute_habit_stats([habit["_id"] for habit in habits], completions, today)
+    return habits, stats
+
+async def model_response(habits, stats, response_field) -> bytes:
+    """The previous path: HabitResponse per habit, response_model validation, JSONResponse"""
+    models = [HabitResponse(**format_habit_stats(habit, [], stats[habit["_id"]])) for habit in habits]
+    content = await serialize_response(field=response_field, response_content=models)
+    return JSONResponse(content).body
+
+async def dict_response(habits, stats) -> bytes:
+    """The current path: response-shaped dicts rendered by orjson"""
+    habits_with_stats = []
+    for habit in habits:
+        habit_with_stats = format_habit_stats(habit, [], stats[habit["_id"]])
+        habit_with_stats["notification"] = {**NOTIFICATION_DEFAULTS, **(habit_with_stats["notification"] or {})}
+        habits_with_stats.append(habit_with_stats)
+    return FastJSONResponse(habits_with_stats).body
+
+async def cpu_per_call(function, iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        await function()
+    return (time.process_time() - start) / iterations
+
+async def run(counts, iterations: int, response_field):
+    print(f"{'habits':>7} {'models ms':>10} {'dicts ms':>9} {'saved ms':>9} {'bytes':>9}")
+    for count in counts:
+        habits, stats = make_habits(count)
+        model_ms = await cpu_per_call(lambda: model_response(habits, stats, response_field), iterations) * 1000
+        dict_ms = await cpu_per_call(lambda: dict_response(habits, stats), iterations) * 1000
+        size = len(await dict_response(habits, stats))
+        print(f"{count:>7} {model_ms:>10.3f} {dict_ms:>9.3f} {model_ms - dict_ms:>9.3f} {size:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--habits", type=int, nargs="+", default=[50, 500])
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+    
+    route = next(route for route in app.routes if getattr(route, "path", None) == "/api/habits" and "GET" in route.methods)
+    asyncio.run(run(args.habits, args.iterations, route.response_field))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Micro-benchmarks of the streak and stats kernels on synthetic completion histories.
+
+Usage: python benchmarks/kernels.py [--days 30 365 1825] [--habits 50] [--density 0.6]
+
+Prints the median and best time per call for each kernel and history length.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import timeit
+import uuid
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analytics import compute_habit_stats
+from utils import (
+    calculate_current_streak, calculate_completion_rate, format_habit_stats, summarize_completion_history
+)
+
+def make_history(habit_id: str, days: int, density: float, today: date):
+    """Completions for the last `days` days, newest first, with some days toggled back off"""
+    completions = []
+    for offset in range(days):
+        roll = random.random()
+        if roll < density:
+            completed = True
+        elif roll < density + 0.05:
+            completed = False
+        else:
+            continue
+        completions.append({
+            "habit_id": habit_id,
+            "date": (today - timedelta(days=offset)).isoformat(),
+            "completed": completed
+        })
+    return completions
+
+def time_call(function, repeat: int = 7):
+    """Median and best seconds per call, sizing the loop count so each sample takes ~0.2s"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    samples = [elapsed / number for elapsed in timer.repeat(repeat=repeat, number=number)]
+    return statistics.median(samples), min(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[30, 365, 1825])
+    parser.add_argument("--habits", type=int, default=50, help="Habits per compute_habit_stats call")
+    parser.add_argument("--density", type=float, default=0.6, help="Share of days checked in")
+    args = parser.parse_args()
+    
+    random.seed(0)
+    today = date.today()
+    habit = {
+        "_id": str(uuid.uuid4()),
+        "name": "Benchmark",
+        "category": "health",
+        "notification": {"enabled": False, "time": "09:00", "days": [1, 2, 3, 4, 5]},
+        "created_at": datetime.utcnow()
+    }
+    
+    print(f"{'kernel':<32} {'days':>6} {'median us':>11} {'best us':>9}")
+    for days in args.days:
+        history = make_history(habit["_id"], days, args.density, today)
+        completed_dates = sorted(completion["date"] for completion in history if completion["completed"])
+        habit_ids = [str(uuid.uuid4()) for _ in range(args.habits)]
+        user_history = [
+            completion
+            for habit_id in habit_ids
+            for completion in make_history(habit_id, days, args.density, today)
+        ]
+    
+        kernels = {
+            "calculate_current_streak": lambda: calculate_current_streak(history, today),
+            "calculate_completion_rate": lambda: calculate_completion_rate(history, 30, today),
+            "format_habit_stats": lambda: format_habit_stats(habit, history, None, today),
+            "summarize_completion_history": lambda: summarize_completion_history(completed_dates),
+            f"compute_habit_stats x{args.habits}": lambda: compute_habit_stats(
+                habit_ids, user_history, today, min(days, 365)
+            ),
+        }
+        for name, kernel in kernels.items():
+            median, best = time_call(kernel)
+            print(f"{name:<32} {days:>6} {median * 1e6:>11.1f} {best * 1e6:>9.1f}")
+
+if __name__ == "__main__":
+    main()
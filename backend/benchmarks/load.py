@@ -0,0 +1,193 @@
+"""Drive server.app in-process with a mix of habit reads and check-ins and report latency per endpoint.
+
+Usage: python benchmarks/load.py [--users 50] [--habits-per-user 8] [--history-days 365]
+                                 [--concurrency 20] [--requests 5000] [--mongomock] [--keep]
+
+Runs against MONGO_URL in a throwaway database (DB_NAME, default habit_tracker_benchmark)
+that is dropped afterwards unless --keep is given. --mongomock uses the in-memory
+mongomock-motor stand-in instead; it lacks pipeline updates, so the toggle endpoint is
+replaced by single-item batch writes in that mode.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import timedelta
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DB_NAME", "habit_tracker_benchmark")
+os.environ.setdefault("REMINDER_SCHEDULER_ENABLED", "false")
+
+from auth import create_access_token
+from database import Database
+from server import app
+from utils import user_today
+
+# Relative weight of each request type; the dashboard polls dominate
+MIX = {
+    "GET /api/habits": 40,
+    "GET /api/habits/stats": 25,
+    "GET /api/habits/{id}/completions": 15,
+    "POST /api/habits/{id}/completions": 15,
+    "POST /api/completions/batch": 5,
+}
+
+class VirtualUser:
+    def __init__(self, user_id: str, habit_ids, today):
+        self.user_id = user_id
+        self.habit_ids = habit_ids
+        self.today = today
+        self.headers = {"Authorization": f"Bearer {create_access_token({'sub': user_id})}"}
+        # ETags per URL, replayed as If-None-Match the way a browser cache revalidates
+        self.etags = {}
+
+async def seed(users: int, habits_per_user: int, history_days: int, density: float):
+    """Create users and habits with a check-in history through the Database layer"""
+    virtual_users = []
+    for index in range(users):
+        user = await Database.create_user({
+            "_id": str(uuid.uuid4()),
+            "email": f"load-{index}@example.com",
+            "name": f"Load {index}",
+            "google_id": f"load-{uuid.uuid4()}",
+            "timezone": "UTC",
+        })
+        today = user_today(user)
+        habit_ids = []
+        for habit_index in range(habits_per_user):
+            habit = await Database.create_habit({
+                "_id": str(uuid.uuid4()),
+                "user_id": user["_id"],
+                "name": f"Habit {habit_index}",
+                "category": "health",
+                "notification": {"enabled": True, "time": "08:00", "days": [1, 2, 3, 4, 5]},
+            })
+            habit_ids.append(habit["_id"])
+        items = [
+            {"habit_id": habit_id, "date": (today - timedelta(days=offset)).isoformat(), "completed": True}
+            for habit_id in habit_ids
+            for offset in range(history_days)
+            if random.random() < density
+        ]
+        for start in range(0, len(items), 500):
+            await Database.bulk_update_completions(user["_id"], items[start:start + 500])
+        virtual_users.append(VirtualUser(user["_id"], habit_ids, today))
+    return virtual_users
+
+async def issue(client: httpx.AsyncClient, user: VirtualUser, kind: str, use_toggle: bool) -> int:
+    habit_id = random.choice(user.habit_ids)
+    day = (user.today - timedelta(days=random.randrange(7))).isoformat()
+    if kind == "GET /api/habits":
+        url = "/api/habits"
+    elif kind == "GET /api/habits/stats":
+        url = "/api/habits/stats"
+    elif kind == "GET /api/habits/{id}/completions":
+        url = f"/api/habits/{habit_id}/completions?days=30"
+    elif kind == "POST /api/habits/{id}/completions" and use_toggle:
+        response = await client.post(f"/api/habits/{habit_id}/completions", json={"date": day}, headers=user.headers)
+        return response.status_code
+    else:
+        count = 1 if kind.startswith("POST /api/habits") else 10
+        items = [
+            {"habit_id": random.choice(user.habit_ids), "date": day, "completed": random.random() < 0.7}
+            for _ in range(count)
+        ]
+        response = await client.post("/api/completions/batch", json={"items": items}, headers=user.headers)
+        return response.status_code
+    
+    headers = dict(user.headers)
+    if url in user.etags:
+        headers["If-None-Match"] = user.etags[url]
+    response = await client.get(url, headers=headers)
+    if "etag" in response.headers:
+        user.etags[url] = response.headers["etag"]
+    return response.status_code
+
+async def run_load(virtual_users, total_requests: int, concurrency: int, use_toggle: bool):
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    kinds, weights = zip(*MIX.items())
+    remaining = total_requests
+    
+    async def worker(client: httpx.AsyncClient):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            user = random.choice(virtual_users)
+            kind = random.choices(kinds, weights)[0]
+            start = time.perf_counter()
+            status_code = await issue(client, user, kind, use_toggle)
+            latencies[kind].append(time.perf_counter() - start)
+            statuses[kind][status_code] += 1
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+def percentile(sorted_values, fraction: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+def report(latencies, statuses, elapsed: float):
+    print(f"{'endpoint':<36} {'count':>6} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}  statuses")
+    for kind in MIX:
+        values = sorted(latencies.get(kind, []))
+        if not values:
+            continue
+        codes = " ".join(f"{code}:{count}" for code, count in sorted(statuses[kind].items()))
+        print(
+            f"{kind:<36} {len(values):>6} {len(values) / elapsed:>8.1f} "
+            f"{percentile(values, 0.50) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f} "
+            f"{percentile(values, 0.99) * 1000:>8.2f}  {codes}"
+        )
+    total = sum(len(values) for values in latencies.values())
+    print(f"{'total':<36} {total:>6} {total / elapsed:>8.1f}  ({elapsed:.1f}s)")
+
+async def main_async(args):
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("--mongomock needs the mongomock-motor package")
+        Database.client = AsyncMongoMockClient()
+        Database.db = Database.client[os.environ["DB_NAME"]]
+    else:
+        await Database.ensure_indexes()
+    
+    try:
+        seed_start = time.perf_counter()
+        virtual_users = await seed(args.users, args.habits_per_user, args.history_days, args.density)
+        print(f"Seeded {args.users} users x {args.habits_per_user} habits in {time.perf_counter() - seed_start:.1f}s")
+        report(*await run_load(virtual_users, args.requests, args.concurrency, not args.mongomock))
+    finally:
+        if not args.keep:
+            await Database.client.drop_database(os.environ["DB_NAME"])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--habits-per-user", type=int, default=8)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--density", type=float, default=0.6, help="Share of history days checked in")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--mongomock", action="store_true", help="Use the in-memory mongomock-motor stand-in")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database")
+    args = parser.parse_args()
+    
+    random.seed(0)
+    # httpx logs every in-process request at INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    asyncio.run(main_async(args))
+
+if __name__ == "__main__":
+    main()
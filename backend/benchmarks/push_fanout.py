@@ -0,0 +1,95 @@
+"""Measure reminder fan-out throughput and lag against a local mock push service.
+
+Usage: python benchmarks/push_fanout.py [--users 2000] [--habits-per-user 3]
+                                        [--throttle-rate 0.05] [--error-rate 0.02]
+                                        [--latency-ms 20]
+"""
+import argparse
+import asyncio
+import base64
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import notifications
+from notifications import PushFanout
+
+def make_handler(throttle_rate: float, error_rate: float, latency: float):
+    class MockPushHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(latency)
+            roll = random.random()
+            if roll < throttle_rate:
+                self.send_response(429)
+                self.send_header("Retry-After", "0")
+            elif roll < throttle_rate + error_rate:
+                self.send_response(503)
+            else:
+                self.send_response(201)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        
+        def log_message(self, format, *args):
+            pass
+    
+    return MockPushHandler
+
+def make_subscription(endpoint: str) -> dict:
+    """A subscription with real client keys so payload encryption runs as in production"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    public_key = key.public_key().public_bytes(
+        serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint
+    )
+    encode = lambda raw: base64.urlsafe_b64encode(raw).decode().rstrip("=")
+    return {"endpoint": endpoint, "keys": {"p256dh": encode(public_key), "auth": encode(os.urandom(16))}}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--habits-per-user", type=int, default=3)
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+    # Throttled and failed attempts are expected here; keep the output to the summary
+    logging.getLogger("notifications").setLevel(logging.CRITICAL)
+    
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), make_handler(args.throttle_rate, args.error_rate, args.latency_ms / 1000)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    endpoint = f"http://127.0.0.1:{server.server_port}/push"
+    
+    vapid = Vapid()
+    vapid.generate_keys()
+    notifications.VAPID_PRIVATE_KEY = vapid
+    notifications.PUSH_RETRY_BASE_SECONDS = 0.05
+    
+    subscriptions = {f"user-{i}": make_subscription(f"{endpoint}/{i}") for i in range(args.users)}
+    habits_by_user = {
+        user_id: [f"Habit {n}" for n in range(args.habits_per_user)]
+        for user_id in subscriptions
+    }
+    
+    # Treat the start of the run as the scheduled minute so lag is the time to reach every user
+    stats = asyncio.run(PushFanout().deliver(habits_by_user, subscriptions, datetime.utcnow()))
+    
+    server.shutdown()
+    print(f"users={args.users} habits/user={args.habits_per_user} concurrency={notifications.PUSH_MAX_CONCURRENCY}")
+    for key, value in stats.items():
+        print(f"  {key}: {value}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Measure worker cold start: importing server, running lifespan startup and serving a first request.
+
+Usage: python benchmarks/startup.py [--runs 10]
+
+Each run is a fresh interpreter. MongoDB does not need to be reachable: the client
+connects lazily and index preparation runs in the background.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line of timings in milliseconds
+CHILD = r"""
+import asyncio, json, sys, time
+start = time.perf_counter()
+import server
+imported = time.perf_counter()
+import httpx
+
+async def serve_first_request():
+    async with server.app.router.lifespan_context(server.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.get("/api/")
+        served = time.perf_counter()
+    return started, served, response.status_code
+
+started, served, status_code = asyncio.run(serve_first_request())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "first_request_ms": (served - started) * 1000,
+    "total_ms": (served - start) * 1000,
+    "status": status_code,
+    "modules": len(sys.modules),
+    "pywebpush_loaded": "pywebpush" in sys.modules,
+}))
+"""
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    
+    env = {**os.environ, "MONGO_URL": os.environ.get("MONGO_URL", "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=100")}
+    results = []
+    for _ in range(args.runs):
+        child = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+        if child.returncode != 0:
+            raise SystemExit(f"Startup run failed:\n{child.stderr}")
+        results.append(json.loads(child.stdout.strip().splitlines()[-1]))
+    
+    for key in ("import_ms", "startup_ms", "first_request_ms", "total_ms"):
+        values = [result[key] for result in results]
+        print(f"{key:<18} median {statistics.median(values):8.1f}   min {min(values):8.1f}   max {max(values):8.1f}")
+    print(f"{'modules loaded':<18} {results[-1]['modules']}")
+    print(f"{'pywebpush loaded':<18} {results[-1]['pywebpush_loaded']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Hashable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries expire after ttl seconds"""
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+    
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+    
+    def clear(self):
+        self._entries.clear()
+    
+    def __len__(self):
+        return len(self._entries)
+
+class CacheBackend:
+    """Async key/value store for computed values shared by read endpoints"""
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Return the cached values for the keys that are present"""
+        raise NotImplementedError
+    
+    async def set_many(self, items: Dict[str, Any]):
+        raise NotImplementedError
+
+class MemoryCacheBackend(CacheBackend):
+    """Per-process LRU backend built on TTLCache"""
+    
+    def __init__(self, maxsize: int = 100000, ttl: float = 24 * 60 * 60):
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = {}
+        for key in keys:
+            value = self.cache.get(key, _MISSING)
+            if value is not _MISSING:
+                values[key] = value
+        return values
+    
+    async def set_many(self, items: Dict[str, Any]):
+        for key, value in items.items():
+            self.cache.set(key, value)
+
+class RedisCacheBackend(CacheBackend):
+    """Backend for any client exposing the redis.asyncio API (mget, pipeline set).
+
+    The cache is an optimization: a failing or unreachable Redis reads as misses and skipped writes.
+    """
+    
+    def __init__(self, client, ttl: int = 24 * 60 * 60):
+        self.client = client
+        self.ttl = ttl
+    
+    @classmethod
+    def from_url(cls, url: str, ttl: int = 24 * 60 * 60) -> "RedisCacheBackend":
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("The redis package is required for a redis:// STATS_CACHE_URL")
+        return cls(redis.from_url(url, socket_connect_timeout=1, socket_timeout=1), ttl)
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        try:
+            values = await self.client.mget(keys)
+        except Exception as e:
+            logger.warning(f"Stats cache read failed, computing instead: {e}")
+            return {}
+        return {
+            key: json.loads(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+    
+    async def set_many(self, items: Dict[str, Any]):
+        if not items:
+            return
+        pipeline = self.client.pipeline()
+        for key, value in items.items():
+            pipeline.set(key, json.dumps(value), ex=self.ttl)
+        try:
+            await pipeline.execute()
+        except Exception as e:
+            logger.warning(f"Stats cache write failed: {e}")
+
+def create_stats_cache() -> CacheBackend:
+    """Build the stats cache from STATS_CACHE_URL (redis://...), defaulting to in-memory"""
+    url = os.environ.get("STATS_CACHE_URL")
+    if url:
+        return RedisCacheBackend.from_url(url)
+    return MemoryCacheBackend()
+
+def habit_stats_key(user_id: str, data_version: int, habit_id: str, day: date) -> str:
+    """Stats cache key; any write bumps the user's data version, so every worker misses afterwards"""
+    return f"habit_stats:{user_id}:{data_version}:{habit_id}:{day.isoformat()}"
@@ -1,11 +1,129 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from typing import Optional, List
+from pymongo import IndexModel, ASCENDING, ReturnDocument, UpdateOne, ReplaceOne
+from bson.int64 import Int64
+from pymongo.errors import DuplicateKeyError, BulkWriteError, PyMongoError
+from typing import Optional, List, Dict, Set, AsyncIterator
+import asyncio
 import os
-from datetime import datetime, date
+import logging
+from datetime import datetime, date, timedelta
+from metrics import QueryListener
+from cache import TTLCache, CacheBackend, create_stats_cache
+from utils import (
+    summarize_completion_history, update_completion_summary, valid_dates, reminder_slots, utc_offset_minutes,
+    bitmap_position, bitmap_dates
+)
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing every query shape below, keyed by collection
+INDEXES = {
+    'users': [
+        IndexModel([("google_id", ASCENDING)], name="google_id_unique", unique=True, sparse=True),
+    ],
+    'habits': [
+        # Keyset pagination of a user's habits in creation order; its prefix serves user_id lookups
+        IndexModel(
+            [("user_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)],
+            name="user_created_at"
+        ),
+        # Multikey index the reminder scheduler reads one (weekday, HH:MM) bucket from
+        IndexModel([("reminder_slots", ASCENDING)], name="reminder_slots"),
+        # Finds habits whose stored UTC offset went stale after a DST change
+        IndexModel([("reminder_timezone", ASCENDING), ("reminder_offset", ASCENDING)], name="reminder_timezone_offset"),
+    ],
+    'completions': [
+        # Serves single completion lookups, per-habit history sorted by date,
+        # per-habit date ranges and delete_habit
+        IndexModel(
+            [("habit_id", ASCENDING), ("user_id", ASCENDING), ("date", ASCENDING)],
+            name="habit_user_date_unique",
+            unique=True
+        ),
+        # Serves per-user date and date-range queries
+        IndexModel([("user_id", ASCENDING), ("date", ASCENDING)], name="user_date"),
+    ],
+    'habit_stats': [
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+    ],
+    'completion_bitmaps': [
+        IndexModel(
+            [("habit_id", ASCENDING), ("user_id", ASCENDING), ("year", ASCENDING)],
+            name="habit_user_year"
+        ),
+        IndexModel([("user_id", ASCENDING), ("year", ASCENDING)], name="user_year"),
+    ],
+    'reminder_runs': [
+        IndexModel([("created_at", ASCENDING)], name="created_at_ttl", expireAfterSeconds=2 * 24 * 60 * 60),
+    ],
+}
+
+# Indexes made redundant by a wider one above, dropped by ensure_indexes where still present
+OBSOLETE_INDEXES = {
+    'habits': ["user_id"],
+}
+
+# Completed dates kept on each habit_stats document, enough for a yearly window
+HABIT_STATS_RECENT_DAYS = 366
+
+# Fields read on the request path; passkeys and push subscriptions are loaded only where used
+USER_PROJECTION = {"webauthn_credentials": 0, "notification_subscription": 0}
+HABIT_PROJECTION = {"_id": 1, "user_id": 1, "name": 1, "category": 1, "notification": 1, "created_at": 1}
+HABIT_STATS_PROJECTION = {"updated_at": 0}
+# Rebuild passes per habit before giving up on a habit_stats document that keeps changing underneath
+HABIT_STATS_REBUILD_ATTEMPTS = 5
+# Overlap between bitmap migration runs, so a worker clock running behind cannot slip a write past the watermark
+MIGRATION_CLOCK_SKEW = timedelta(minutes=5)
+
+# Representative filter (and sort) for every query issued by Database, used to check plans
+QUERY_SHAPES = [
+    ('users', {"google_id": ""}, None),
+    ('users', {"_id": ""}, None),
+    ('habits', {"user_id": ""}, None),
+    ('habits', {"_id": "", "user_id": ""}, None),
+    ('habits', {"user_id": "", "$or": [{"created_at": {"$gt": 0}}, {"created_at": 0, "_id": {"$gt": ""}}]},
+     [("created_at", 1), ("_id", 1)]),
+    ('habits', {"reminder_slots": ""}, None),
+    ('habits', {"reminder_timezone": "", "reminder_offset": {"$ne": 0}}, None),
+    ('completions', {"habit_id": "", "user_id": "", "date": ""}, None),
+    ('completions', {"habit_id": "", "user_id": "", "date": {"$gte": "", "$lte": ""}}, [("date", -1)]),
+    ('completions', {"habit_id": "", "user_id": "", "date": {"$gte": "", "$lte": ""}, "completed": True}, None),
+    ('completions', {"user_id": ""}, [("date", 1)]),
+    ('habits', {"user_id": ""}, [("created_at", 1), ("_id", 1)]),
+    ('completion_bitmaps', {"user_id": ""}, [("year", 1)]),
+    ('completions', {"user_id": "", "date": "", "completed": True}, None),
+    ('completions', {"user_id": "", "habit_id": {"$in": [""]}, "completed": True}, [("date", 1)]),
+    ('habit_stats', {"_id": {"$in": [""]}, "user_id": ""}, None),
+    ('habit_stats', {"user_id": ""}, None),
+    ('completion_bitmaps', {"habit_id": "", "user_id": "", "year": {"$gte": 0}}, [("year", 1)]),
+    ('completion_bitmaps', {"user_id": "", "habit_id": {"$in": [""]}}, [("year", 1)]),
+    ('completion_bitmaps', {"user_id": "", "year": {"$gte": 0, "$lte": 0}}, None),
+]
+
+def _plan_stages(plan) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
 
 class Database:
     client = None
     db = None
+    # (habit_id, user_id) pairs known to exist; habits never change owner, only get deleted
+    habit_owner_cache = TTLCache(maxsize=10000, ttl=300)
+    # Authenticated users by id; the TTL bounds staleness from writes made by other workers
+    user_cache = TTLCache(maxsize=10000, ttl=30)
+    # Computed per-habit stats keyed by (user, data version, habit, day); writes bump the version
+    stats_cache: Optional[CacheBackend] = None
+    # "documents": one completions document per check-in; "bitmap": one bitset per habit-year
+    completion_storage = "documents"
     
     @classmethod
     def initialize(cls):
@@ -13,8 +131,23 @@ class Database:
             # MongoDB connection
             mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
             db_name = os.environ.get('DB_NAME', 'test_database')
-            cls.client = AsyncIOMotorClient(mongo_url)
+            cls.client = AsyncIOMotorClient(mongo_url, event_listeners=[QueryListener()])
             cls.db = cls.client[db_name]
+            cls.completion_storage = os.environ.get('COMPLETION_STORAGE', 'documents')
+        if cls.stats_cache is None:
+            # Built here rather than at import so a STATS_CACHE_URL loaded from .env applies
+            cls.stats_cache = create_stats_cache()
+    
+    @classmethod
+    def close(cls):
+        if cls.client is not None:
+            cls.client.close()
+            cls.client = None
+            cls.db = None
+    
+    @classmethod
+    def uses_bitmaps(cls) -> bool:
+        return cls.completion_storage == "bitmap"
     
     @classmethod
     def get_db(cls):
@@ -27,6 +160,58 @@ class Database:
         db = cls.get_db()
         return db[name]
     
+    @classmethod
+    def get_stats_cache(cls) -> CacheBackend:
+        if cls.stats_cache is None:
+            cls.initialize()
+        return cls.stats_cache
+    
+    @classmethod
+    async def ensure_indexes(cls) -> List[str]:
+        """Create the indexes in INDEXES; safe to run on every startup. Returns the collections that failed"""
+        failed = []
+        for collection_name, indexes in INDEXES.items():
+            collection = cls.get_collection(collection_name)
+            # One collection's failure (e.g. duplicates blocking a unique index) must not skip the rest
+            try:
+                if collection_name in OBSOLETE_INDEXES:
+                    existing = await collection.index_information()
+                    for index_name in OBSOLETE_INDEXES[collection_name]:
+                        if index_name in existing:
+                            await collection.drop_index(index_name)
+                            logger.info(f"Dropped obsolete index {index_name} on {collection_name}")
+                created = await collection.create_indexes(indexes)
+            except PyMongoError as e:
+                failed.append(collection_name)
+                if getattr(e, "code", None) == 11000:
+                    logger.error(
+                        f"Duplicate documents block a unique index on {collection_name}; "
+                        f"run dedupe_completions.py: {e}"
+                    )
+                else:
+                    logger.error(f"Failed to ensure indexes on {collection_name}: {e}")
+                continue
+            logger.info(f"Indexes ensured on {collection_name}: {', '.join(created)}")
+        return failed
+    
+    @classmethod
+    async def explain_query_shapes(cls) -> List[dict]:
+        """Log the winning plan of every query shape and warn about collection scans"""
+        plans = []
+        for collection_name, query, sort in QUERY_SHAPES:
+            cursor = cls.get_collection(collection_name).find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explanation = await cursor.explain()
+            stages = _plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+            plans.append({"collection": collection_name, "query": query, "sort": sort, "stages": stages})
+            
+            if "COLLSCAN" in stages:
+                logger.warning(f"Collection scan for {collection_name} query {query} sort {sort}: {stages}")
+            else:
+                logger.info(f"Query plan for {collection_name} query {query} sort {sort}: {stages}")
+        return plans
+    
     # User operations
     @staticmethod
     async def create_user(user_data: dict) -> dict:
@@ -40,7 +225,7 @@ class Database:
     @staticmethod
     async def get_user_by_google_id(google_id: str) -> Optional[dict]:
         users_collection = Database.get_collection('users')
-        user = await users_collection.find_one({"google_id": google_id})
+        user = await users_collection.find_one({"google_id": google_id}, USER_PROJECTION)
         if user:
             user["_id"] = str(user["_id"])
         return user
@@ -48,11 +233,19 @@ class Database:
     @staticmethod
     async def get_user_by_id(user_id: str) -> Optional[dict]:
         users_collection = Database.get_collection('users')
-        user = await users_collection.find_one({"_id": user_id})
+        user = await users_collection.find_one({"_id": user_id}, USER_PROJECTION)
         if user:
             user["_id"] = str(user["_id"])
         return user
     
+    @staticmethod
+    async def update_user_timezone(user_id: str, timezone: str) -> bool:
+        """Store the user's timezone and move their habits' reminders to the matching UTC slots"""
+        updated = await Database.update_user(user_id, {"timezone": timezone})
+        await Database.refresh_reminder_slots({"user_id": user_id}, timezone)
+        await Database.bump_data_version(user_id)
+        return updated
+    
     @staticmethod
     async def update_user(user_id: str, update_data: dict) -> bool:
         update_data["updated_at"] = datetime.utcnow()
@@ -61,22 +254,69 @@ class Database:
             {"_id": user_id},
             {"$set": update_data}
         )
+        Database.user_cache.delete(user_id)
+        return result.modified_count > 0
+    
+    @staticmethod
+    async def get_data_version(user_id: str) -> int:
+        """The user's data version, bumped by every write that changes what the habit endpoints return"""
+        users_collection = Database.get_collection('users')
+        user = await users_collection.find_one({"_id": user_id}, {"data_version": 1})
+        return user.get("data_version", 0) if user else 0
+    
+    @staticmethod
+    async def bump_data_version(user_id: str):
+        users_collection = Database.get_collection('users')
+        await users_collection.update_one({"_id": user_id}, {"$inc": {"data_version": 1}})
+    
+    @staticmethod
+    async def add_webauthn_credential(user_id: str, credential: dict) -> bool:
+        users_collection = Database.get_collection('users')
+        result = await users_collection.update_one(
+            {"_id": user_id},
+            {"$push": {"webauthn_credentials": credential}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        Database.user_cache.delete(user_id)
         return result.modified_count > 0
     
     # Habit operations
     @staticmethod
-    async def create_habit(habit_data: dict) -> dict:
+    async def create_habit(habit_data: dict, timezone: str = "UTC") -> dict:
         habit_data["created_at"] = datetime.utcnow()
         habit_data["updated_at"] = datetime.utcnow()
+        habit_data.update(Database._reminder_fields(habit_data.get("notification"), timezone))
         habits_collection = Database.get_collection('habits')
         result = await habits_collection.insert_one(habit_data)
         habit_data["_id"] = str(result.inserted_id)
+        await Database.bump_data_version(habit_data["user_id"])
         return habit_data
     
     @staticmethod
     async def get_user_habits(user_id: str) -> List[dict]:
         habits_collection = Database.get_collection('habits')
-        cursor = habits_collection.find({"user_id": user_id})
+        cursor = habits_collection.find({"user_id": user_id}, HABIT_PROJECTION)
+        habits = []
+        async for habit in cursor:
+            habit["_id"] = str(habit["_id"])
+            habits.append(habit)
+        return habits
+    
+    @staticmethod
+    async def get_user_habits_page(user_id: str, after_id: Optional[str], limit: int) -> Optional[List[dict]]:
+        """Up to limit habits in creation order, starting after the after_id habit; None if after_id is unknown"""
+        habits_collection = Database.get_collection('habits')
+        query = {"user_id": user_id}
+        if after_id is not None:
+            anchor = await habits_collection.find_one({"_id": after_id, "user_id": user_id}, {"created_at": 1})
+            if anchor is None:
+                return None
+            query["$or"] = [
+                {"created_at": {"$gt": anchor["created_at"]}},
+                {"created_at": anchor["created_at"], "_id": {"$gt": after_id}}
+            ]
+        cursor = habits_collection.find(query, HABIT_PROJECTION).sort(
+            [("created_at", ASCENDING), ("_id", ASCENDING)]
+        ).limit(limit)
         habits = []
         async for habit in cursor:
             habit["_id"] = str(habit["_id"])
@@ -86,28 +326,62 @@ class Database:
     @staticmethod
     async def get_habit_by_id(habit_id: str, user_id: str) -> Optional[dict]:
         habits_collection = Database.get_collection('habits')
-        habit = await habits_collection.find_one({
-            "_id": habit_id,
-            "user_id": user_id
-        })
+        habit = await habits_collection.find_one(
+            {"_id": habit_id, "user_id": user_id},
+            HABIT_PROJECTION
+        )
         if habit:
             habit["_id"] = str(habit["_id"])
         return habit
     
     @staticmethod
-    async def update_habit(habit_id: str, user_id: str, update_data: dict) -> bool:
+    async def habit_belongs_to_user(habit_id: str, user_id: str) -> bool:
+        """Check habit ownership, answering repeat checks from habit_owner_cache"""
+        if Database.habit_owner_cache.get((habit_id, user_id)):
+            return True
+        
+        habits_collection = Database.get_collection('habits')
+        habit = await habits_collection.find_one(
+            {"_id": habit_id, "user_id": user_id},
+            {"_id": 1}
+        )
+        if habit:
+            Database.habit_owner_cache.set((habit_id, user_id), True)
+        return habit is not None
+    
+    @staticmethod
+    async def get_user_habit_ids(user_id: str, habit_ids: List[str]) -> Set[str]:
+        """Return which of habit_ids belong to the user, with a single query"""
+        habits_collection = Database.get_collection('habits')
+        cursor = habits_collection.find(
+            {"_id": {"$in": list(habit_ids)}, "user_id": user_id},
+            {"_id": 1}
+        )
+        
+        owned = set()
+        async for habit in cursor:
+            owned.add(str(habit["_id"]))
+            Database.habit_owner_cache.set((str(habit["_id"]), user_id), True)
+        return owned
+    
+    @staticmethod
+    async def update_habit(habit_id: str, user_id: str, update_data: dict, timezone: str = "UTC") -> bool:
         update_data["updated_at"] = datetime.utcnow()
+        if "notification" in update_data:
+            update_data.update(Database._reminder_fields(update_data["notification"], timezone))
         habits_collection = Database.get_collection('habits')
         result = await habits_collection.update_one(
             {"_id": habit_id, "user_id": user_id},
             {"$set": update_data}
         )
+        await Database.bump_data_version(user_id)
         return result.modified_count > 0
     
     @staticmethod
     async def delete_habit(habit_id: str, user_id: str) -> bool:
         habits_collection = Database.get_collection('habits')
         completions_collection = Database.get_collection('completions')
+        Database.habit_owner_cache.delete((habit_id, user_id))
         # Delete habit
         habit_result = await habits_collection.delete_one({
             "_id": habit_id,
@@ -119,57 +393,238 @@ class Database:
             "habit_id": habit_id,
             "user_id": user_id
         })
+        await Database.get_collection('completion_bitmaps').delete_many({
+            "habit_id": habit_id,
+            "user_id": user_id
+        })
         
+        await Database.get_collection('habit_stats').delete_one({"_id": habit_id, "user_id": user_id})
+        await Database.bump_data_version(user_id)
         return habit_result.deleted_count > 0
     
     # Completion operations
     @staticmethod
     async def get_completion(habit_id: str, user_id: str, date_str: str) -> Optional[dict]:
+        if Database.uses_bitmaps():
+            return await Database._get_bitmap_completion(habit_id, user_id, date_str)
         completions_collection = Database.get_collection('completions')
-        completion = await completions_collection.find_one({
-            "habit_id": habit_id,
-            "user_id": user_id,
-            "date": date_str
-        })
+        completion = await completions_collection.find_one(
+            {"habit_id": habit_id, "user_id": user_id, "date": date_str},
+            {"habit_id": 1, "user_id": 1, "date": 1, "completed": 1}
+        )
         if completion:
             completion["_id"] = str(completion["_id"])
         return completion
     
     @staticmethod
     async def create_completion(completion_data: dict) -> dict:
+        if Database.uses_bitmaps():
+            await Database.update_completion(
+                completion_data["habit_id"], completion_data["user_id"],
+                completion_data["date"], completion_data.get("completed", True)
+            )
+            return completion_data
         completion_data["created_at"] = datetime.utcnow()
         completions_collection = Database.get_collection('completions')
-        result = await completions_collection.insert_one(completion_data)
+        result, stats = await asyncio.gather(
+            completions_collection.insert_one(completion_data),
+            Database._find_habit_stats(completion_data["habit_id"], completion_data["user_id"])
+        )
+        await Database.apply_completion_change(
+            completion_data["habit_id"], completion_data["user_id"],
+            completion_data["date"], completion_data.get("completed", True), stats
+        )
         completion_data["_id"] = str(result.inserted_id)
         return completion_data
     
     @staticmethod
     async def update_completion(habit_id: str, user_id: str, date_str: str, completed: bool) -> bool:
+        if Database.uses_bitmaps():
+            bit_operation = "or" if completed else "and"
+            changed, stats = await asyncio.gather(
+                Database._update_bitmap(habit_id, user_id, date_str, bit_operation),
+                Database._find_habit_stats(habit_id, user_id)
+            )
+            await Database.apply_completion_change(habit_id, user_id, date_str, completed, stats)
+            return changed is not None
         completions_collection = Database.get_collection('completions')
-        result = await completions_collection.update_one(
-            {
-                "habit_id": habit_id,
-                "user_id": user_id,
-                "date": date_str
-            },
-            {
-                "$set": {
-                    "completed": completed,
-                    "created_at": datetime.utcnow()
-                }
-            },
-            upsert=True
-        )
+        query = {
+            "habit_id": habit_id,
+            "user_id": user_id,
+            "date": date_str
+        }
+        update = {
+            "$set": {
+                "completed": completed,
+                "created_at": datetime.utcnow()
+            }
+        }
+        
+        async def write():
+            try:
+                return await completions_collection.update_one(query, update, upsert=True)
+            except DuplicateKeyError:
+                # A concurrent upsert inserted the same date first; the document now exists
+                return await completions_collection.update_one(query, update)
+        
+        result, stats = await asyncio.gather(write(), Database._find_habit_stats(habit_id, user_id))
+        await Database.apply_completion_change(habit_id, user_id, date_str, completed, stats)
         return result.modified_count > 0 or result.upserted_id is not None
     
     @staticmethod
-    async def get_habit_completions(habit_id: str, user_id: str, days: int = 30) -> List[dict]:
+    async def bulk_update_completions(user_id: str, items: List[dict]) -> Dict[int, str]:
+        """Upsert many completions with one unordered bulk write; returns errors by item index"""
+        if Database.uses_bitmaps():
+            return await Database._bulk_update_bitmaps(user_id, items)
         completions_collection = Database.get_collection('completions')
-        # Get completions for the last N days
-        cursor = completions_collection.find({
+        now = datetime.utcnow()
+        operations = [
+            UpdateOne(
+                {
+                    "habit_id": item["habit_id"],
+                    "user_id": user_id,
+                    "date": item["date"]
+                },
+                {
+                    "$set": {
+                        "completed": item["completed"],
+                        "created_at": now
+                    }
+                },
+                upsert=True
+            )
+            for item in items
+        ]
+        if not operations:
+            return {}
+        
+        errors = {}
+        try:
+            await completions_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            errors = {
+                error["index"]: error.get("errmsg", "Write failed")
+                for error in e.details.get("writeErrors", [])
+            }
+        await Database.rebuild_habit_stats_documents(user_id, {item["habit_id"] for item in items})
+        await Database.bump_data_version(user_id)
+        return errors
+    
+    @staticmethod
+    async def toggle_completion(habit_id: str, user_id: str, date_str: str) -> bool:
+        """Atomically flip a completion (creating it as completed) and return the new status"""
+        if Database.uses_bitmaps():
+            completed, stats = await asyncio.gather(
+                Database._update_bitmap(habit_id, user_id, date_str, "xor"),
+                Database._find_habit_stats(habit_id, user_id)
+            )
+            await Database.apply_completion_change(habit_id, user_id, date_str, completed, stats)
+            return completed
+        completions_collection = Database.get_collection('completions')
+        query = {
             "habit_id": habit_id,
-            "user_id": user_id
-        }).sort("date", -1).limit(days * 2)  # Extra buffer for missed days
+            "user_id": user_id,
+            "date": date_str
+        }
+        # Update pipeline so the new value is derived from the stored one server-side;
+        # a missing document or field counts as not completed
+        update = [{
+            "$set": {
+                "completed": {"$not": [{"$eq": ["$completed", True]}]},
+                "created_at": datetime.utcnow()
+            }
+        }]
+        
+        async def flip():
+            try:
+                return await completions_collection.find_one_and_update(
+                    query, update,
+                    projection={"_id": 0, "completed": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # A concurrent toggle inserted the same date first; flip the existing document
+                return await completions_collection.find_one_and_update(
+                    query, update,
+                    projection={"_id": 0, "completed": 1},
+                    return_document=ReturnDocument.AFTER
+                )
+        
+        # The stats read does not depend on the flip, so both go out together
+        completion, stats = await asyncio.gather(flip(), Database._find_habit_stats(habit_id, user_id))
+        completed = bool(completion and completion["completed"])
+        await Database.apply_completion_change(habit_id, user_id, date_str, completed, stats)
+        return completed
+    
+    @staticmethod
+    async def iter_habit_completions(
+        habit_id: str,
+        user_id: str,
+        start_date: str,
+        end_date: Optional[str] = None,
+        limit: Optional[int] = None
+    ) -> AsyncIterator[dict]:
+        """Stream a habit's {date, completed} entries with start_date <= date <= end_date, newest first"""
+        if Database.uses_bitmaps():
+            completions = await Database._get_bitmap_completions(
+                {"habit_id": habit_id, "user_id": user_id}, start_date, end_date
+            )
+            completions.sort(key=lambda completion: completion["date"], reverse=True)
+            for completion in completions[:limit]:
+                yield {"date": completion["date"], "completed": True}
+            return
+        
+        completions_collection = Database.get_collection('completions')
+        date_range = {"$gte": start_date}
+        if end_date is not None:
+            date_range["$lte"] = end_date
+        cursor = completions_collection.find(
+            {"habit_id": habit_id, "user_id": user_id, "date": date_range},
+            {"_id": 0, "date": 1, "completed": 1}
+        ).sort("date", -1)
+        if limit is not None:
+            cursor = cursor.limit(limit)
+        async for completion in cursor:
+            yield completion
+    
+    @staticmethod
+    async def count_habit_completions(habit_id: str, user_id: str, start_date: str, end_date: str) -> int:
+        """Number of completed days for a habit with start_date <= date <= end_date"""
+        if Database.uses_bitmaps():
+            completions = await Database._get_bitmap_completions(
+                {"habit_id": habit_id, "user_id": user_id}, start_date, end_date
+            )
+            return len(completions)
+        completions_collection = Database.get_collection('completions')
+        return await completions_collection.count_documents({
+            "habit_id": habit_id,
+            "user_id": user_id,
+            "date": {"$gte": start_date, "$lte": end_date},
+            "completed": True
+        })
+    
+    @staticmethod
+    async def get_habit_completions(
+        habit_id: str,
+        user_id: str,
+        start_date: str,
+        end_date: Optional[str] = None
+    ) -> List[dict]:
+        return [
+            completion
+            async for completion in Database.iter_habit_completions(habit_id, user_id, start_date, end_date)
+        ]
+    
+    @staticmethod
+    async def get_user_completions_for_date(user_id: str, date_str: str) -> List[dict]:
+        if Database.uses_bitmaps():
+            return await Database._get_bitmap_completions({"user_id": user_id}, date_str, date_str)
+        completions_collection = Database.get_collection('completions')
+        cursor = completions_collection.find(
+            {"user_id": user_id, "date": date_str, "completed": True},
+            {"habit_id": 1, "user_id": 1, "date": 1, "completed": 1}
+        )
         
         completions = []
         async for completion in cursor:
@@ -179,17 +634,467 @@ class Database:
         return completions
     
     @staticmethod
-    async def get_user_completions_for_date(user_id: str, date_str: str) -> List[dict]:
+    async def iter_user_habits(user_id: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Stream a user's habits in creation order, fetching batch_size documents per round trip"""
+        habits_collection = Database.get_collection('habits')
+        cursor = habits_collection.find({"user_id": user_id}, HABIT_PROJECTION).sort(
+            [("created_at", ASCENDING), ("_id", ASCENDING)]
+        ).batch_size(batch_size)
+        async for habit in cursor:
+            habit["_id"] = str(habit["_id"])
+            yield habit
+    
+    @staticmethod
+    async def iter_user_completions(user_id: str, batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Stream all of a user's {habit_id, date, completed} entries by date without loading them at once"""
+        if Database.uses_bitmaps():
+            bitmaps = Database.get_collection('completion_bitmaps').find(
+                {"user_id": user_id}
+            ).sort("year", ASCENDING).batch_size(batch_size)
+            async for bitmap in bitmaps:
+                for date_str in bitmap_dates(bitmap):
+                    yield {"habit_id": bitmap["habit_id"], "date": date_str, "completed": True}
+            return
+        
         completions_collection = Database.get_collection('completions')
-        cursor = completions_collection.find({
+        cursor = completions_collection.find(
+            {"user_id": user_id},
+            {"_id": 0, "habit_id": 1, "date": 1, "completed": 1}
+        ).sort("date", ASCENDING).batch_size(batch_size)
+        async for completion in cursor:
+            yield completion
+    
+    # Bitmap completion storage: one document per (habit, year) with day bits in words w0..w5
+    @staticmethod
+    def _bitmap_key(habit_id: str, user_id: str, year: int) -> dict:
+        return {"_id": f"{habit_id}:{year}", "habit_id": habit_id, "user_id": user_id, "year": year}
+    
+    @staticmethod
+    async def _update_bitmap(habit_id: str, user_id: str, date_str: str, bit_operation: str) -> Optional[bool]:
+        """Atomically or/and/xor a day's bit, creating the habit-year document; returns the new bit"""
+        bitmaps_collection = Database.get_collection('completion_bitmaps')
+        year, word, mask = bitmap_position(date_str)
+        operand = Int64(~mask) if bit_operation == "and" else Int64(mask)
+        update = {
+            "$bit": {word: {bit_operation: operand}},
+            "$set": {"updated_at": datetime.utcnow()}
+        }
+        query = Database._bitmap_key(habit_id, user_id, year)
+        try:
+            bitmap = await bitmaps_collection.find_one_and_update(
+                query, update,
+                projection={word: 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # A concurrent write created this habit-year first
+            bitmap = await bitmaps_collection.find_one_and_update(
+                query, update,
+                projection={word: 1},
+                return_document=ReturnDocument.AFTER
+            )
+        if bitmap is None:
+            return None
+        return bool(bitmap.get(word, 0) & mask)
+    
+    @staticmethod
+    async def _bulk_update_bitmaps(user_id: str, items: List[dict]) -> Dict[int, str]:
+        bitmaps_collection = Database.get_collection('completion_bitmaps')
+        now = datetime.utcnow()
+        errors = {}
+        operations = []
+        operation_indexes = []
+        for index, item in enumerate(items):
+            try:
+                year, word, mask = bitmap_position(item["date"])
+            except ValueError:
+                errors[index] = "Invalid date"
+                continue
+            bit_update = {"or": Int64(mask)} if item["completed"] else {"and": Int64(~mask)}
+            operations.append(UpdateOne(
+                Database._bitmap_key(item["habit_id"], user_id, year),
+                {"$bit": {word: bit_update}, "$set": {"updated_at": now}},
+                upsert=True
+            ))
+            operation_indexes.append(index)
+        
+        if operations:
+            try:
+                await bitmaps_collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                for error in e.details.get("writeErrors", []):
+                    errors[operation_indexes[error["index"]]] = error.get("errmsg", "Write failed")
+        
+        await Database.rebuild_habit_stats_documents(user_id, {item["habit_id"] for item in items})
+        await Database.bump_data_version(user_id)
+        return errors
+    
+    @staticmethod
+    async def _get_bitmap_completions(
+        query: dict,
+        start_date: str,
+        end_date: Optional[str] = None
+    ) -> List[dict]:
+        """Completed days from start_date through end_date (inclusive) from the bitmaps matching query"""
+        bitmaps_collection = Database.get_collection('completion_bitmaps')
+        years = {"$gte": int(start_date[:4])}
+        if end_date is not None:
+            years["$lte"] = int(end_date[:4])
+        cursor = bitmaps_collection.find({**query, "year": years})
+        
+        completions = []
+        async for bitmap in cursor:
+            for date_str in bitmap_dates(bitmap):
+                if date_str >= start_date and (end_date is None or date_str <= end_date):
+                    completions.append({
+                        "habit_id": bitmap["habit_id"],
+                        "user_id": bitmap["user_id"],
+                        "date": date_str,
+                        "completed": True
+                    })
+        return completions
+    
+    @staticmethod
+    async def _get_bitmap_completion(habit_id: str, user_id: str, date_str: str) -> Optional[dict]:
+        year, word, mask = bitmap_position(date_str)
+        bitmap = await Database.get_collection('completion_bitmaps').find_one(
+            Database._bitmap_key(habit_id, user_id, year), {word: 1}
+        )
+        if bitmap is None:
+            return None
+        return {
+            "habit_id": habit_id,
             "user_id": user_id,
             "date": date_str,
-            "completed": True
-        })
+            "completed": bool(bitmap.get(word, 0) & mask)
+        }
+    
+    @staticmethod
+    async def migrate_completions_to_bitmaps(batch_size: int = 1000) -> int:
+        """Copy each day's status written since the previous run from the completions collection into habit-year bitmaps"""
+        completions_collection = Database.get_collection('completions')
+        bitmaps_collection = Database.get_collection('completion_bitmaps')
+        migrations_collection = Database.get_collection('migrations')
+        started_at = datetime.utcnow()
+        # Every completion write stamps created_at, so a re-run only replays rows changed since the watermark.
+        # Rows written before it would otherwise overwrite bits that bitmap-mode workers have changed since.
+        state = await migrations_collection.find_one({"_id": "completion_bitmaps"})
+        query = {"created_at": {"$gte": state["migrated_through"]}} if state else {}
+        cursor = completions_collection.find(
+            query,
+            {"_id": 0, "habit_id": 1, "user_id": 1, "date": 1, "completed": 1}
+        ).batch_size(batch_size)
         
-        completions = []
+        migrated = 0
+        operations = []
         async for completion in cursor:
-            completion["_id"] = str(completion["_id"])
-            completions.append(completion)
+            try:
+                year, word, mask = bitmap_position(completion["date"])
+            except ValueError:
+                logger.warning(f"Skipping completion with invalid date: {completion}")
+                continue
+            bit_update = {"or": Int64(mask)} if completion.get("completed") else {"and": Int64(~mask)}
+            operations.append(UpdateOne(
+                Database._bitmap_key(completion["habit_id"], completion["user_id"], year),
+                {"$bit": {word: bit_update}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True
+            ))
+            if len(operations) >= batch_size:
+                await bitmaps_collection.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+                operations = []
+        if operations:
+            await bitmaps_collection.bulk_write(operations, ordered=False)
+            migrated += len(operations)
+        await migrations_collection.update_one(
+            {"_id": "completion_bitmaps"},
+            {"$set": {"migrated_through": started_at - MIGRATION_CLOCK_SKEW}},
+            upsert=True
+        )
+        return migrated
+    
+    @staticmethod
+    async def dedupe_completions() -> int:
+        """Keep the latest written document per (habit_id, user_id, date) and delete the rest"""
+        completions_collection = Database.get_collection('completions')
+        # created_at is reset by every toggle, so the newest document holds the user's last choice
+        duplicates = completions_collection.aggregate([
+            {"$sort": {"created_at": -1}},
+            {"$group": {
+                "_id": {"habit_id": "$habit_id", "user_id": "$user_id", "date": "$date"},
+                "ids": {"$push": "$_id"},
+                "count": {"$sum": 1}
+            }},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        
+        removed = 0
+        affected = set()
+        async for duplicate in duplicates:
+            result = await completions_collection.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+            removed += result.deleted_count
+            affected.add((duplicate["_id"]["habit_id"], duplicate["_id"]["user_id"]))
+        
+        for user_id in {user_id for _, user_id in affected}:
+            await Database.rebuild_habit_stats_documents(
+                user_id, [habit_id for habit_id, habit_user_id in affected if habit_user_id == user_id]
+            )
+            await Database.bump_data_version(user_id)
+        return removed
+    
+    # Materialized habit stats
+    @staticmethod
+    async def rebuild_habit_stats(habit_id: str, user_id: str) -> dict:
+        """Recompute a habit's habit_stats document from stored completions"""
+        return (await Database.rebuild_habit_stats_documents(user_id, [habit_id]))[habit_id]
+    
+    @staticmethod
+    async def rebuild_habit_stats_documents(user_id: str, habit_ids) -> Dict[str, dict]:
+        """Recompute habit_stats documents for several of a user's habits, retrying any changed meanwhile"""
+        documents = {}
+        pending = list(habit_ids)
+        for attempt in range(HABIT_STATS_REBUILD_ATTEMPTS):
+            if not pending:
+                break
+            rebuilt, pending = await Database._rebuild_habit_stats_pass(user_id, pending)
+            documents.update(rebuilt)
+        if pending:
+            logger.warning(f"habit_stats of {user_id} kept changing during rebuild, left as written: {pending}")
+        return documents
+    
+    @staticmethod
+    async def _rebuild_habit_stats_pass(user_id: str, habit_ids: List[str]):
+        """One read of the completions and one bulk write; returns the documents and the habits whose write lost a race"""
+        stats_collection = Database.get_collection('habit_stats')
+        # Read before the completions; each write only lands if no other stats write came in between
+        revisions = {
+            str(stats["_id"]): stats.get("revision")
+            async for stats in stats_collection.find({"_id": {"$in": habit_ids}}, {"revision": 1})
+        }
+        completed_by_habit = {habit_id: [] for habit_id in habit_ids}
+        if Database.uses_bitmaps():
+            bitmaps = Database.get_collection('completion_bitmaps').find(
+                {"user_id": user_id, "habit_id": {"$in": habit_ids}}
+            ).sort("year", 1)
+            async for bitmap in bitmaps:
+                completed_by_habit[bitmap["habit_id"]].extend(bitmap_dates(bitmap))
+        else:
+            completions_collection = Database.get_collection('completions')
+            cursor = completions_collection.find(
+                {"user_id": user_id, "habit_id": {"$in": habit_ids}, "completed": True},
+                {"_id": 0, "habit_id": 1, "date": 1}
+            ).sort("date", 1)
+            async for completion in cursor:
+                completed_by_habit[completion["habit_id"]].append(completion["date"])
+            # A malformed stored date must not make the habit's stats unbuildable
+            completed_by_habit = {
+                habit_id: valid_dates(completed_dates) for habit_id, completed_dates in completed_by_habit.items()
+            }
+        
+        recent_start = (date.today() - timedelta(days=HABIT_STATS_RECENT_DAYS - 1)).isoformat()
+        now = datetime.utcnow()
+        documents = {}
+        operations = []
+        operation_habit_ids = []
+        for habit_id, completed_dates in completed_by_habit.items():
+            stats = summarize_completion_history(completed_dates)
+            stats.update({
+                "user_id": user_id,
+                "recent_dates": [date_str for date_str in completed_dates if date_str >= recent_start],
+                "revision": (revisions.get(habit_id) or 0) + 1,
+                "updated_at": now
+            })
+            # A document whose revision moved on fails the filter, and the upsert then hits the _id index
+            operations.append(ReplaceOne({"_id": habit_id, "revision": revisions.get(habit_id)}, stats, upsert=True))
+            operation_habit_ids.append(habit_id)
+            documents[habit_id] = {**stats, "_id": habit_id}
+        
+        conflicts = []
+        try:
+            await stats_collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") != 11000:
+                    raise
+                conflicts.append(operation_habit_ids[error["index"]])
+        return documents, conflicts
+    
+    @staticmethod
+    async def _find_habit_stats(habit_id: str, user_id: str) -> Optional[dict]:
+        return await Database.get_collection('habit_stats').find_one(
+            {"_id": habit_id, "user_id": user_id}, HABIT_STATS_PROJECTION
+        )
+    
+    @staticmethod
+    async def apply_completion_change(
+        habit_id: str,
+        user_id: str,
+        date_str: str,
+        completed: bool,
+        stats: Optional[dict]
+    ):
+        """Update a habit's habit_stats document after one completion was written; stats is the document as read before"""
+        recent_start = (date.today() - timedelta(days=HABIT_STATS_RECENT_DAYS - 1)).isoformat()
+        changes = update_completion_summary(stats, date_str, completed, recent_start) if stats else None
+        if changes == {}:
+            return  # The day already had this status
+        
+        if changes is None:
+            # Only the full history can tell, e.g. a day before the recent window changed
+            await Database.rebuild_habit_stats(habit_id, user_id)
+        else:
+            changes["updated_at"] = datetime.utcnow()
+            result = await Database.get_collection('habit_stats').update_one(
+                # Only apply on top of the revision read; a concurrent change falls back to a rebuild
+                {"_id": habit_id, "revision": stats.get("revision")},
+                {"$set": changes, "$inc": {"revision": 1}}
+            )
+            if result.matched_count == 0:
+                await Database.rebuild_habit_stats(habit_id, user_id)
+        
+        # After the stats write, so a reader seeing the new version also sees the new stats
+        await Database.bump_data_version(user_id)
+    
+    @staticmethod
+    async def get_habit_stats_documents(user_id: str, habit_ids: List[str]) -> Dict[str, dict]:
+        """Get materialized stats for the habits, rebuilding any that are missing"""
+        stats_collection = Database.get_collection('habit_stats')
+        cursor = stats_collection.find(
+            {"_id": {"$in": list(habit_ids)}, "user_id": user_id},
+            HABIT_STATS_PROJECTION
+        )
+        documents = {str(stats["_id"]): stats async for stats in cursor}
+        
+        missing = [habit_id for habit_id in habit_ids if habit_id not in documents]
+        documents.update(await Database.rebuild_habit_stats_documents(user_id, missing))
+        return documents
+    
+    @staticmethod
+    async def rebuild_all_habit_stats(user_id: Optional[str] = None, batch_size: int = 100) -> int:
+        """Rebuild habit_stats for every habit (or one user's habits) to repair drift"""
+        habits_collection = Database.get_collection('habits')
+        query = {"user_id": user_id} if user_id else {}
+        
+        rebuilt = 0
+        batch_user_id = None
+        batch = []
+        
+        async def flush():
+            await Database.rebuild_habit_stats_documents(batch_user_id, batch)
+            # Cached stats are keyed by data version, so a bump retires the pre-rebuild values
+            await Database.bump_data_version(batch_user_id)
+        
+        # Sorted by user so each user's habits rebuild in batches
+        async for habit in habits_collection.find(query, {"_id": 1, "user_id": 1}).sort("user_id", 1):
+            if batch and (habit["user_id"] != batch_user_id or len(batch) >= batch_size):
+                await flush()
+                batch = []
+            batch_user_id = habit["user_id"]
+            batch.append(str(habit["_id"]))
+            rebuilt += 1
+        if batch:
+            await flush()
+        return rebuilt
+    
+    # Reminder scheduling
+    @staticmethod
+    async def get_habits_for_reminder_slot(slot: str) -> List[dict]:
+        """Get the habits whose reminders fire in a (weekday, HH:MM) bucket"""
+        habits_collection = Database.get_collection('habits')
+        cursor = habits_collection.find(
+            {"reminder_slots": slot},
+            {"_id": 1, "user_id": 1, "name": 1}
+        )
+        
+        habits = []
+        async for habit in cursor:
+            habit["_id"] = str(habit["_id"])
+            habits.append(habit)
+        return habits
+    
+    @staticmethod
+    async def get_notification_subscriptions(user_ids) -> Dict[str, dict]:
+        """Get push subscriptions for the users that have one, keyed by user id"""
+        users_collection = Database.get_collection('users')
+        cursor = users_collection.find(
+            {"_id": {"$in": list(user_ids)}, "notification_subscription": {"$ne": None}},
+            {"_id": 1, "notification_subscription": 1}
+        )
+        return {str(user["_id"]): user["notification_subscription"] async for user in cursor}
+    
+    @staticmethod
+    async def remove_notification_subscription(user_id: str, endpoint: str) -> bool:
+        """Drop a user's push subscription, unless it was replaced by a different endpoint"""
+        users_collection = Database.get_collection('users')
+        result = await users_collection.update_one(
+            {"_id": user_id, "notification_subscription.endpoint": endpoint},
+            {"$set": {"notification_subscription": None, "updated_at": datetime.utcnow()}}
+        )
+        Database.user_cache.delete(user_id)
+        return result.modified_count > 0
+    
+    @staticmethod
+    async def claim_reminder_run(run_key: str) -> bool:
+        """Claim a scheduler run (a reminder minute or a maintenance pass) so only one worker performs it"""
+        runs_collection = Database.get_collection('reminder_runs')
+        try:
+            await runs_collection.insert_one({"_id": run_key, "created_at": datetime.utcnow()})
+        except DuplicateKeyError:
+            return False
+        return True
+    
+    @staticmethod
+    def _reminder_fields(notification_settings: Optional[dict], timezone: str) -> dict:
+        """Reminder index fields for a habit: UTC slots plus the zone and offset they were built with"""
+        offset = utc_offset_minutes(timezone, datetime.utcnow().date())
+        return {
+            "reminder_slots": reminder_slots(notification_settings, offset),
+            "reminder_timezone": timezone,
+            "reminder_offset": offset
+        }
+    
+    @staticmethod
+    async def refresh_reminder_slots(query: dict, timezone: Optional[str] = None, batch_size: int = 1000) -> int:
+        """Recompute reminder slots for matching habits, in timezone or each habit's stored zone"""
+        habits_collection = Database.get_collection('habits')
+        cursor = habits_collection.find(
+            query, {"_id": 1, "notification": 1, "reminder_timezone": 1}
+        ).batch_size(batch_size)
+        
+        updated = 0
+        operations = []
+        async for habit in cursor:
+            habit_timezone = timezone or habit.get("reminder_timezone") or "UTC"
+            operations.append(UpdateOne(
+                {"_id": habit["_id"]},
+                {"$set": Database._reminder_fields(habit.get("notification"), habit_timezone)}
+            ))
+            if len(operations) >= batch_size:
+                await habits_collection.bulk_write(operations, ordered=False)
+                updated += len(operations)
+                operations = []
+        if operations:
+            await habits_collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+        return updated
+    
+    @staticmethod
+    async def backfill_reminder_slots() -> int:
+        """Index reminder slots for habits created before the scheduler existed"""
+        return await Database.refresh_reminder_slots({"reminder_slots": {"$exists": False}})
+    
+    @staticmethod
+    async def refresh_reminder_offsets() -> int:
+        """Re-slot habits in zones whose UTC offset changed (daylight saving transitions)"""
+        habits_collection = Database.get_collection('habits')
+        today = datetime.utcnow().date()
         
-        return completions
\ No newline at end of file
+        updated = 0
+        for timezone in await habits_collection.distinct("reminder_timezone"):
+            if not timezone:
+                continue
+            updated += await Database.refresh_reminder_slots(
+                {"reminder_timezone": timezone, "reminder_offset": {"$ne": utc_offset_minutes(timezone, today)}}
+            )
+        return updated
@@ -0,0 +1,32 @@
+"""Remove duplicate (habit_id, user_id, date) completions, then build the unique index they block.
+
+Usage: python dedupe_completions.py
+
+Safe to re-run. Needed when ensure_indexes logs that duplicates block habit_user_date_unique.
+"""
+import asyncio
+from pathlib import Path
+
+import typer
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import Database
+
+def main():
+    """Keep the latest completion for each habit and date and recreate the indexes"""
+    async def dedupe():
+        removed = await Database.dedupe_completions()
+        failed = await Database.ensure_indexes()
+        return removed, failed
+    
+    removed, failed = asyncio.run(dedupe())
+    typer.echo(f"Removed {removed} duplicate completions")
+    if failed:
+        typer.echo(f"Indexes still failing on: {', '.join(failed)}", err=True)
+        raise typer.Exit(1)
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,186 @@
+"""Per-route request latency and MongoDB command metrics in the Prometheus text format."""
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Warn when a single request sends more than this many commands to one collection
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", "10"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key: LabelKey, extra: Sequence[Tuple[str, str]] = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escape = lambda value: str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.values: Dict[LabelKey, float] = defaultdict(float)
+        self.lock = threading.Lock()
+    
+    def inc(self, labels: Dict[str, str], amount: float = 1.0):
+        with self.lock:
+            self.values[_label_key(labels)] += amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value:g}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        # Per label set: [count per bucket (+Inf last), sum]
+        self.values: Dict[LabelKey, list] = {}
+        self.lock = threading.Lock()
+    
+    def observe(self, labels: Dict[str, str], value: float):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total:g}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route template", LATENCY_BUCKETS
+)
+requests_total = Counter("http_requests_total", "Requests by route template and status")
+request_commands = Histogram(
+    "http_request_mongodb_commands", "MongoDB commands issued per request", COMMAND_COUNT_BUCKETS
+)
+request_command_seconds = Histogram(
+    "http_request_mongodb_seconds", "Time spent in MongoDB commands per request", LATENCY_BUCKETS
+)
+command_duration = Histogram(
+    "mongodb_command_duration_seconds", "MongoDB command latency by command and collection", LATENCY_BUCKETS
+)
+command_failures = Counter("mongodb_command_failures_total", "Failed MongoDB commands by command and collection")
+n_plus_one_requests = Counter(
+    "n_plus_one_requests_total",
+    f"Requests that sent more than {N_PLUS_ONE_THRESHOLD} commands to one collection"
+)
+
+REGISTRY = [
+    request_duration, requests_total, request_commands, request_command_seconds,
+    command_duration, command_failures, n_plus_one_requests,
+]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+class RequestCommands:
+    """MongoDB commands attributed to one request; updated from Motor's executor threads"""
+    
+    def __init__(self):
+        self.by_collection: Dict[str, int] = defaultdict(int)
+        self.seconds = 0.0
+        self.lock = threading.Lock()
+    
+    def record(self, collection: str, seconds: float):
+        with self.lock:
+            self.by_collection[collection] += 1
+            self.seconds += seconds
+
+# Motor copies the caller's context into its executor, so listener callbacks see the request's value
+current_request_commands: ContextVar[Optional[RequestCommands]] = ContextVar(
+    "current_request_commands", default=None
+)
+
+class QueryListener(monitoring.CommandListener):
+    """Times every MongoDB command and attributes it to the request that issued it"""
+    
+    def __init__(self):
+        self.pending: Dict[Tuple[int, object], str] = {}
+        self.lock = threading.Lock()
+    
+    def started(self, event):
+        target = event.command.get(event.command_name)
+        collection = target if isinstance(target, str) else event.command.get("collection", "-")
+        with self.lock:
+            self.pending[(event.request_id, event.connection_id)] = collection
+    
+    def _finished(self, event) -> Tuple[str, float]:
+        with self.lock:
+            collection = self.pending.pop((event.request_id, event.connection_id), "-")
+        seconds = event.duration_micros / 1e6
+        command_duration.observe({"command": event.command_name, "collection": collection}, seconds)
+        request_commands_seen = current_request_commands.get()
+        if request_commands_seen is not None:
+            request_commands_seen.record(collection, seconds)
+        return collection, seconds
+    
+    def succeeded(self, event):
+        self._finished(event)
+    
+    def failed(self, event):
+        collection, _ = self._finished(event)
+        command_failures.inc({"command": event.command_name, "collection": collection})
+
+async def track_request(request, call_next):
+    """HTTP middleware body: time the request and check its MongoDB command counts"""
+    commands = RequestCommands()
+    token = current_request_commands.set(commands)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        current_request_commands.reset(token)
+        # Label by route template; unmatched paths share one label to bound cardinality
+        route = request.scope.get("route")
+        route_path = getattr(route, "path", "unmatched")
+        labels = {"method": request.method, "route": route_path}
+        request_duration.observe(labels, elapsed)
+        requests_total.inc({**labels, "status": str(status_code)})
+        request_commands.observe(labels, sum(commands.by_collection.values()))
+        request_command_seconds.observe(labels, commands.seconds)
+    
+        for collection, count in commands.by_collection.items():
+            if count > N_PLUS_ONE_THRESHOLD:
+                n_plus_one_requests.inc({**labels, "collection": collection})
+                logger.warning(
+                    f"Possible N+1: {request.method} {route_path} sent {count} commands to {collection}"
+                )
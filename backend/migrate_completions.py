@@ -0,0 +1,34 @@
+"""Copy the completions collection into habit-year bitmaps for COMPLETION_STORAGE=bitmap.
+
+Usage: python migrate_completions.py [--batch-size 1000]
+
+Each run copies only completions written since the previous one (plus a few minutes of
+overlap), so it can be re-run. Run it before switching a deployment to bitmap storage, then
+once more right after the last documents-storage worker has stopped, to pick up check-ins
+written in between. Stop there: a later run would replay the overlap over check-ins that
+bitmap-storage workers have made since.
+"""
+import asyncio
+from pathlib import Path
+
+import typer
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import Database
+
+def main(batch_size: int = typer.Option(1000, help="Completions written per bulk_write")):
+    """Migrate every day's completion status into completion_bitmaps and rebuild materialized stats"""
+    async def migrate():
+        migrated = await Database.migrate_completions_to_bitmaps(batch_size)
+        Database.completion_storage = "bitmap"
+        rebuilt = await Database.rebuild_all_habit_stats()
+        return migrated, rebuilt
+    
+    migrated, rebuilt = asyncio.run(migrate())
+    typer.echo(f"Migrated {migrated} completions and rebuilt stats for {rebuilt} habits")
+
+if __name__ == "__main__":
+    typer.run(main)
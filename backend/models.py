@@ -1,8 +1,21 @@
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
+from pydantic import BaseModel, Field, EmailStr, AfterValidator
+from typing import List, Optional, Dict, Any, Annotated
 from datetime import datetime, date
 import uuid
 
+def check_date_string(value: str) -> str:
+    """Reject anything but a real calendar date written as YYYY-MM-DD"""
+    try:
+        parsed = date.fromisoformat(value)
+    except ValueError:
+        parsed = None
+    if parsed is None or parsed.isoformat() != value:
+        raise ValueError("must be a valid date in YYYY-MM-DD format")
+    return value
+
+# Dates are stored and compared as YYYY-MM-DD strings
+DateString = Annotated[str, AfterValidator(check_date_string)]
+
 # User Models
 class WebAuthnCredential(BaseModel):
     credential_id: str
@@ -21,6 +34,7 @@ class User(BaseModel):
     picture: Optional[str] = None
     webauthn_credentials: List[WebAuthnCredential] = []
     notification_subscription: Optional[NotificationSubscription] = None
+    timezone: str = "UTC"  # IANA zone name
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -35,6 +49,10 @@ class UserResponse(BaseModel):
     email: str
     name: str
     picture: Optional[str] = None
+    timezone: str = "UTC"
+
+class TimezoneUpdateRequest(BaseModel):
+    timezone: str  # IANA zone name, e.g. "Europe/Berlin"
 
 # Habit Models
 class NotificationSettings(BaseModel):
@@ -67,6 +85,7 @@ class HabitResponse(BaseModel):
     category: str
     notification: NotificationSettings
     created_at: datetime
+    stats: Optional[Dict[str, Any]] = None
 
 # Completion Models
 class Completion(BaseModel):
@@ -78,17 +97,38 @@ class Completion(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class CompletionToggle(BaseModel):
-    date: str  # YYYY-MM-DD format
+    date: DateString
 
 class CompletionResponse(BaseModel):
     date: str
     completed: bool
 
+class CompletionBatchItem(BaseModel):
+    habit_id: str
+    date: DateString
+    completed: bool
+
+class CompletionBatchRequest(BaseModel):
+    items: List[CompletionBatchItem] = Field(..., min_length=1, max_length=500)
+
+class CompletionBatchResult(BaseModel):
+    habit_id: str
+    date: str
+    completed: bool
+    status: str  # "ok", "not_found" or "error"
+    error: Optional[str] = None
+
+class CompletionBatchResponse(BaseModel):
+    results: List[CompletionBatchResult]
+
 # Stats Models
 class HabitStats(BaseModel):
     habit_id: str
     current_streak: int
     completion_rate: float  # percentage
+    longest_streak: int = 0
+    rolling_rates: Dict[int, float] = {}  # window in days -> percentage
+    weekday_rates: List[float] = []  # percentage per weekday, Sunday first
 
 class OverallStats(BaseModel):
     total_habits: int
@@ -99,6 +139,7 @@ class OverallStats(BaseModel):
 # Authentication Models
 class GoogleAuthRequest(BaseModel):
     token: str
+    timezone: Optional[str] = None  # IANA zone name reported by the client
 
 class WebAuthnRegisterRequest(BaseModel):
     credential_id: str
@@ -1,8 +1,15 @@
-from pywebpush import webpush, WebPushException
+import asyncio
 import json
 import os
-from typing import Dict, Any
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from typing import Dict, Any, List, Optional, Tuple
 import logging
+import requests
+from database import Database
 
 logger = logging.getLogger(__name__)
 
@@ -13,32 +20,112 @@ VAPID_CLAIMS = {
     "sub": "mailto:your-email@example.com"
 }
 
+# webpush is blocking (HTTP request plus payload encryption), so it runs on a bounded pool
+PUSH_MAX_CONCURRENCY = int(os.environ.get("PUSH_MAX_CONCURRENCY", "16"))
+PUSH_TIMEOUT_SECONDS = float(os.environ.get("PUSH_TIMEOUT_SECONDS", "10"))
+PUSH_MAX_RETRIES = int(os.environ.get("PUSH_MAX_RETRIES", "3"))
+PUSH_RETRY_BASE_SECONDS = float(os.environ.get("PUSH_RETRY_BASE_SECONDS", "0.5"))
+
+# Push service responses meaning the subscription is gone for good
+EXPIRED_SUBSCRIPTION_STATUSES = {404, 410}
+
 class NotificationService:
+    _executor = None
+    _semaphore = None
+    _session = None
     
     @staticmethod
     def get_vapid_public_key():
         return VAPID_PUBLIC_KEY
     
-    @staticmethod
-    async def send_notification(subscription_info: Dict[str, Any], payload: Dict[str, Any]) -> bool:
-        """Send push notification to user"""
-        try:
-            response = webpush(
-                subscription_info=subscription_info,
-                data=json.dumps(payload),
-                vapid_private_key=VAPID_PRIVATE_KEY,
-                vapid_claims=VAPID_CLAIMS
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=PUSH_MAX_CONCURRENCY, thread_name_prefix="webpush"
             )
+        return cls._executor
+    
+    @classmethod
+    def _get_semaphore(cls) -> asyncio.Semaphore:
+        if cls._semaphore is None:
+            cls._semaphore = asyncio.Semaphore(PUSH_MAX_CONCURRENCY)
+        return cls._semaphore
+    
+    @classmethod
+    def shutdown(cls):
+        if cls._executor is not None:
+            cls._executor.shutdown(wait=False, cancel_futures=True)
+            cls._executor = None
+        if cls._session is not None:
+            cls._session.close()
+            cls._session = None
+    
+    @classmethod
+    def _get_session(cls) -> requests.Session:
+        # Shared session so pushes to the same push service reuse pooled connections
+        if cls._session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=PUSH_MAX_CONCURRENCY, pool_maxsize=PUSH_MAX_CONCURRENCY
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            cls._session = session
+        return cls._session
+    
+    @classmethod
+    async def push(cls, subscription_info: Dict[str, Any], payload: Dict[str, Any]) -> Tuple[int, Optional[str]]:
+        """Deliver one push; returns the push service's HTTP status and Retry-After.
+        
+        The status is 0 when the push service could not be reached and -1 when the push
+        could not be built (for example a malformed subscription).
+        """
+        # Imported here so workers that never send a push skip loading pywebpush
+        from pywebpush import webpush, WebPushException
+        
+        send = partial(
+            webpush,
+            subscription_info=subscription_info,
+            data=json.dumps(payload),
+            vapid_private_key=VAPID_PRIVATE_KEY,
+            vapid_claims=VAPID_CLAIMS,
+            timeout=PUSH_TIMEOUT_SECONDS,
+            requests_session=cls._get_session()
+        )
+        try:
+            # Waiting for a slot here keeps a burst from queueing unbounded work on the pool
+            async with cls._get_semaphore():
+                loop = asyncio.get_running_loop()
+                response = await asyncio.wait_for(
+                    loop.run_in_executor(cls._get_executor(), send),
+                    timeout=PUSH_TIMEOUT_SECONDS + 1
+                )
+            return response.status_code, None
             
-            logger.info(f"Notification sent successfully: {response.status_code}")
-            return True
-            
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out sending notification to {subscription_info.get('endpoint')}")
+            return 0, None
         except WebPushException as ex:
             logger.error(f"Failed to send notification: {ex}")
-            return False
+            if ex.response is None:
+                return 0, None
+            return ex.response.status_code, ex.response.headers.get("Retry-After")
+        except requests.RequestException as ex:
+            logger.error(f"Could not reach push service: {ex}")
+            return 0, None
         except Exception as ex:
             logger.error(f"Unexpected error sending notification: {ex}")
-            return False
+            return -1, None
+    
+    @classmethod
+    async def send_notification(cls, subscription_info: Dict[str, Any], payload: Dict[str, Any]) -> bool:
+        """Send push notification to user without blocking the event loop"""
+        status_code, _ = await cls.push(subscription_info, payload)
+        if 200 <= status_code < 300:
+            logger.info(f"Notification sent successfully: {status_code}")
+            return True
+        return False
     
     @staticmethod
     def create_habit_reminder_payload(habit_name: str) -> Dict[str, Any]:
@@ -62,6 +149,19 @@ class NotificationService:
             ]
         }
     
+    @staticmethod
+    def create_habits_reminder_payload(habit_names: List[str]) -> Dict[str, Any]:
+        """Create one notification payload reminding about several habits at once"""
+        if len(habit_names) == 1:
+            return NotificationService.create_habit_reminder_payload(habit_names[0])
+        
+        shown = ", ".join(habit_names[:3])
+        if len(habit_names) > 3:
+            shown += f" and {len(habit_names) - 3} more"
+        payload = NotificationService.create_habit_reminder_payload(shown)
+        payload["body"] = f"Time to complete {len(habit_names)} habits: {shown}"
+        return payload
+    
     @staticmethod  
     def create_test_notification_payload(message: str) -> Dict[str, Any]:
         """Create test notification payload"""
@@ -70,4 +170,72 @@ class NotificationService:
             "body": message,
             "icon": "/icon-192x192.png",
             "tag": "test-notification"
-        }
\ No newline at end of file
+        }
+
+def _is_retryable(status_code: int) -> bool:
+    return status_code == 0 or status_code == 429 or status_code >= 500
+
+def _retry_delay(attempt: int, retry_after: Optional[str]) -> float:
+    """Full-jitter exponential backoff, never shorter than a numeric Retry-After"""
+    delay = random.uniform(0, PUSH_RETRY_BASE_SECONDS * (2 ** attempt))
+    try:
+        return max(delay, float(retry_after)) if retry_after else delay
+    except ValueError:
+        return delay
+
+class PushFanout:
+    """Delivers one coalesced reminder per user with bounded concurrency, retries and pruning"""
+    
+    async def deliver(
+        self,
+        habits_by_user: Dict[str, List[str]],
+        subscriptions: Dict[str, Dict[str, Any]],
+        scheduled_at: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """Send reminders for {user_id: [habit names]}; scheduled_at is a naive UTC datetime"""
+        started = time.monotonic()
+        outcomes = await asyncio.gather(*[
+            self._deliver_to_user(
+                user_id,
+                subscriptions[user_id],
+                NotificationService.create_habits_reminder_payload(habit_names)
+            )
+            for user_id, habit_names in habits_by_user.items()
+            if user_id in subscriptions
+        ])
+        duration = time.monotonic() - started
+        
+        stats = {
+            "sent": sum(1 for outcome, _ in outcomes if outcome == "sent"),
+            "failed": sum(1 for outcome, _ in outcomes if outcome == "failed"),
+            "pruned": sum(1 for outcome, _ in outcomes if outcome == "pruned"),
+            "retries": sum(retries for _, retries in outcomes),
+            "duration_seconds": round(duration, 3),
+            "pushes_per_second": round(len(outcomes) / duration, 1) if duration > 0 else 0.0,
+        }
+        if scheduled_at is not None:
+            stats["lag_seconds"] = round((datetime.utcnow() - scheduled_at).total_seconds(), 3)
+        return stats
+    
+    async def _deliver_to_user(
+        self,
+        user_id: str,
+        subscription: Dict[str, Any],
+        payload: Dict[str, Any]
+    ) -> Tuple[str, int]:
+        retries = 0
+        while True:
+            status_code, retry_after = await NotificationService.push(subscription, payload)
+            if 200 <= status_code < 300:
+                return "sent", retries
+            
+            if status_code in EXPIRED_SUBSCRIPTION_STATUSES:
+                await Database.remove_notification_subscription(user_id, subscription.get("endpoint"))
+                logger.info(f"Removed expired push subscription for user {user_id}")
+                return "pruned", retries
+            
+            if not _is_retryable(status_code) or retries >= PUSH_MAX_RETRIES:
+                return "failed", retries
+            
+            await asyncio.sleep(_retry_delay(retries, retry_after))
+            retries += 1
@@ -0,0 +1,122 @@
+"""Opt-in sampling profiler writing collapsed stacks per route.
+
+A request is profiled when PROFILE_SAMPLE_RATE picks it, or when it sends the header
+`X-Profile: $PROFILE_TOKEN`. While profiled requests are in flight a background thread
+samples the event loop thread's stack every PROFILE_INTERVAL_MS. Each sample is kept
+only if it runs inside a profiled request, which tells concurrent requests apart. When
+the request finishes, its stacks are appended to PROFILE_DIR/<METHOD>_<route>.folded.
+flamegraph.pl, speedscope and inferno read that format directly.
+"""
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN")
+PROFILE_DIR = Path(os.environ.get("PROFILE_DIR", "profiles"))
+PROFILE_INTERVAL_SECONDS = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+PROFILE_HEADER = b"x-profile"
+
+def profiling_enabled() -> bool:
+    return PROFILE_SAMPLE_RATE > 0 or bool(PROFILE_TOKEN)
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Samples one thread's stack, counting collapsed stacks under registered root frames"""
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.thread_id: Optional[int] = None
+        self.roots: Dict[object, Counter] = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+    
+    def start(self, root, thread_id: int):
+        """Begin collecting stacks that pass through root, a frame running on thread_id"""
+        with self.lock:
+            self.thread_id = thread_id
+            self.roots[root] = Counter()
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self.thread.start()
+        self.wake.set()
+    
+    def stop(self, root) -> Counter:
+        """Stop collecting for root and return a copy of its samples, safe to read from any thread"""
+        with self.lock:
+            return Counter(self.roots.pop(root, None))
+    
+    def _run(self):
+        while True:
+            if not self.roots:
+                self.wake.clear()
+                self.wake.wait()
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            # Held while counting so stop() never races an increment
+            with self.lock:
+                while frame is not None:
+                    samples = self.roots.get(frame)
+                    if samples is not None:
+                        # Only the frames below the request's middleware belong to it
+                        samples[";".join(reversed(stack))] += 1
+                        break
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+
+sampler = StackSampler(PROFILE_INTERVAL_SECONDS)
+
+def _profile_path(method: str, route_path: str) -> Path:
+    return PROFILE_DIR / f"{method}_{re.sub(r'[^A-Za-z0-9]+', '_', route_path).strip('_') or 'root'}.folded"
+
+def _append_samples(path: Path, samples: Counter):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a") as profile:
+        for stack, count in samples.items():
+            if stack:
+                profile.write(f"{stack} {count}\n")
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling the sampled or explicitly requested share of HTTP requests"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    def _should_profile(self, scope) -> bool:
+        if PROFILE_TOKEN and dict(scope["headers"]).get(PROFILE_HEADER) == PROFILE_TOKEN.encode():
+            return True
+        return random.random() < PROFILE_SAMPLE_RATE
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+    
+        # This coroutine's frame stays on the stack while the endpoint runs in the same task
+        root = sys._getframe()
+        sampler.start(root, threading.get_ident())
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            samples = sampler.stop(root)
+            route_path = getattr(scope.get("route"), "path", "unmatched")
+            if samples:
+                try:
+                    await asyncio.to_thread(_append_samples, _profile_path(scope["method"], route_path), samples)
+                except OSError as e:
+                    logger.error(f"Failed to write profile for {route_path}: {e}")
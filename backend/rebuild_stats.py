@@ -0,0 +1,23 @@
+"""Rebuild materialized habit_stats documents from the completions collection.
+
+Usage: python rebuild_stats.py [--user-id USER_ID]
+"""
+import asyncio
+from pathlib import Path
+from typing import Optional
+
+import typer
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from database import Database
+
+def main(user_id: Optional[str] = typer.Option(None, help="Only rebuild this user's habits")):
+    """Recompute streak counters and recent dates for every habit to repair drift"""
+    rebuilt = asyncio.run(Database.rebuild_all_habit_stats(user_id))
+    typer.echo(f"Rebuilt stats for {rebuilt} habits")
+
+if __name__ == "__main__":
+    typer.run(main)
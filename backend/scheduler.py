@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from database import Database
+from notifications import PushFanout
+from utils import notification_weekday, reminder_slot
+
+logger = logging.getLogger(__name__)
+
+class ReminderScheduler:
+    """Sends habit reminders each UTC minute by reading only that minute's reminder_slots bucket"""
+    
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._runs = set()
+        self.fanout = PushFanout()
+    
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        tasks = [task for task in [self._task, *self._runs] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._runs.clear()
+    
+    async def _run(self):
+        await self.backfill(datetime.utcnow().replace(second=0, microsecond=0))
+        
+        while True:
+            now = datetime.utcnow()
+            next_minute = now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            await asyncio.sleep((next_minute - now).total_seconds())
+            
+            # Sending runs in the background so a slow minute never delays the next tick
+            run = asyncio.create_task(self.run_minute(next_minute))
+            self._runs.add(run)
+            run.add_done_callback(self._runs.discard)
+            
+            if next_minute.minute == 0:
+                refresh = asyncio.create_task(self.refresh_offsets(next_minute))
+                self._runs.add(refresh)
+                refresh.add_done_callback(self._runs.discard)
+    
+    async def backfill(self, minute: datetime):
+        """Startup pass that indexes legacy habits; workers starting in the same minute run it once"""
+        try:
+            if not await Database.claim_reminder_run(f"backfill {minute.isoformat()}"):
+                return
+            backfilled = await Database.backfill_reminder_slots()
+            if backfilled:
+                logger.info(f"Indexed reminder slots for {backfilled} habits")
+        except Exception as e:
+            logger.error(f"Failed to backfill reminder slots: {e}")
+    
+    async def refresh_offsets(self, hour: datetime):
+        """Hourly pass that keeps UTC slots right across daylight saving changes"""
+        try:
+            if not await Database.claim_reminder_run(f"offsets {hour.isoformat()}"):
+                return
+            refreshed = await Database.refresh_reminder_offsets()
+            if refreshed:
+                logger.info(f"Moved reminder slots for {refreshed} habits after UTC offset changes")
+        except Exception as e:
+            logger.error(f"Failed to refresh reminder offsets: {e}")
+    
+    async def run_minute(self, minute: datetime) -> int:
+        """Send the reminders due at a UTC minute; returns how many users were reached"""
+        slot = reminder_slot(notification_weekday(minute.date()), minute.hour, minute.minute)
+        try:
+            if not await Database.claim_reminder_run(f"{minute.date().isoformat()} {slot}"):
+                return 0
+            
+            habits = await Database.get_habits_for_reminder_slot(slot)
+            if not habits:
+                return 0
+            
+            # Coalesce every habit due for the same user into one push
+            habits_by_user = {}
+            for habit in habits:
+                habits_by_user.setdefault(habit["user_id"], []).append(habit["name"])
+            
+            subscriptions = await Database.get_notification_subscriptions(habits_by_user.keys())
+            stats = await self.fanout.deliver(habits_by_user, subscriptions, minute)
+        except Exception as e:
+            logger.error(f"Failed to send reminders for {slot}: {e}")
+            return 0
+        
+        logger.info(f"Reminders for {slot}: {stats}")
+        return stats["sent"]
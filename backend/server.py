@@ -1,28 +1,55 @@
-from fastapi import FastAPI, APIRouter, Depends, HTTPException, status
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response, status
 from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+import orjson
+import asyncio
+import csv
+import hashlib
+import io
+import zlib
 import os
+import sys
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import List
-from datetime import datetime, date, timedelta
+from typing import Any, AsyncIterator, List, Dict, Optional
+from urllib.parse import urlencode
+from datetime import date, timedelta
 import uuid
 
-# Import our modules
-from models import *
+# Import our modules; the push notification stack (pywebpush) loads on first use
+from models import (
+    AuthResponse, UserResponse, GoogleAuthRequest, TimezoneUpdateRequest, WebAuthnRegisterRequest,
+    NotificationSettings, HabitCreate, HabitUpdate, HabitResponse, HabitStats, OverallStats,
+    CompletionToggle, CompletionBatchRequest, CompletionBatchResult, CompletionBatchResponse,
+    NotificationSubscribeRequest, TestNotificationRequest
+)
 from database import Database
-from auth import create_access_token, verify_google_token, get_current_user, get_or_create_user
-from notifications import NotificationService
-from utils import calculate_current_streak, calculate_completion_rate, format_habit_stats
+from cache import habit_stats_key
+from metrics import PROMETHEUS_CONTENT_TYPE, render_metrics, track_request
+from profiling import ProfilingMiddleware, profiling_enabled
+from auth import (
+    create_access_token, verify_google_token, get_current_user, get_or_create_user, close_http_client
+)
+from analytics import compute_habit_stats
+from utils import (
+    calculate_habits_stats, format_habit_stats, streak_from_run,
+    is_valid_timezone, user_today
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Initialize database connection
-Database.initialize()
+# Days of completion history loaded for streak and rate calculations
+STATS_WINDOW_DAYS = 365
 
-# Create the main app without a prefix
-app = FastAPI(title="Habit Tracker API")
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -35,6 +62,11 @@ async def google_auth(request: GoogleAuthRequest):
         google_user_data = await verify_google_token(request.token)
         user = await get_or_create_user(google_user_data)
         
+        # Keep the stored timezone in step with the client's
+        if request.timezone and request.timezone != user.get("timezone") and is_valid_timezone(request.timezone):
+            await Database.update_user_timezone(user["_id"], request.timezone)
+            user["timezone"] = request.timezone
+        
         # Create JWT token
         access_token = create_access_token(data={"sub": user["_id"]})
         
@@ -44,7 +76,8 @@ async def google_auth(request: GoogleAuthRequest):
                 id=user["_id"],
                 email=user["email"],
                 name=user["name"],
-                picture=user.get("picture")
+                picture=user.get("picture"),
+                timezone=user.get("timezone") or "UTC"
             )
         )
     except Exception as e:
@@ -60,7 +93,29 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
         id=current_user["_id"],
         email=current_user["email"],
         name=current_user["name"],
-        picture=current_user.get("picture")
+        picture=current_user.get("picture"),
+        timezone=current_user.get("timezone") or "UTC"
+    )
+
+@api_router.put("/auth/me/timezone", response_model=UserResponse)
+async def update_timezone(
+    request: TimezoneUpdateRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Set the user's timezone, used for "today" in stats and for reminder times"""
+    if not is_valid_timezone(request.timezone):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown timezone: {request.timezone}"
+        )
+    
+    await Database.update_user_timezone(current_user["_id"], request.timezone)
+    return UserResponse(
+        id=current_user["_id"],
+        email=current_user["email"],
+        name=current_user["name"],
+        picture=current_user.get("picture"),
+        timezone=request.timezone
     )
 
 @api_router.post("/auth/webauthn/register")
@@ -77,12 +132,7 @@ async def register_webauthn(
         }
         
         # Add to user's webauthn credentials
-        current_credentials = current_user.get("webauthn_credentials", [])
-        current_credentials.append(credential)
-        
-        await Database.update_user(current_user["_id"], {
-            "webauthn_credentials": current_credentials
-        })
+        await Database.add_webauthn_credential(current_user["_id"], credential)
         
         return {"message": "WebAuthn credentials registered successfully"}
     except Exception as e:
@@ -91,20 +141,118 @@ async def register_webauthn(
             detail=f"Failed to register WebAuthn credentials: {str(e)}"
         )
 
+class FastJSONResponse(ORJSONResponse):
+    """orjson response for list endpoints that build response-shaped dicts themselves"""
+    
+    def render(self, content) -> bytes:
+        # Rolling-rate windows are integer keys
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+NOTIFICATION_DEFAULTS = NotificationSettings().dict()
+HABIT_STATS_FIELDS = tuple(HabitStats.model_fields)
+
+# Page size caps for the list endpoints
+HABITS_PAGE_DEFAULT = 100
+HABITS_PAGE_MAX = 200
+COMPLETIONS_PAGE_MAX = 366
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in (
+        candidate.removeprefix("W/") for candidate in candidates
+    )
+
+# Browsers may keep habit responses but must revalidate them with the ETag every time
+REVALIDATE_HEADERS = {"Cache-Control": "private, no-cache"}
+
+def data_etag(request: Request, version: int, today: date) -> str:
+    """ETag of a habit read: the user's data version, their current day and the exact URL"""
+    url_hash = hashlib.sha1(f"{request.url.path}?{request.url.query}".encode()).hexdigest()[:16]
+    return f'W/"{version}-{today.isoformat()}-{url_hash}"'
+
+def not_modified(request: Request, etag: str) -> Optional[Response]:
+    """A 304 response when If-None-Match already names etag"""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={**REVALIDATE_HEADERS, "ETag": etag})
+    return None
+
+def etag_response(content: Any, etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    return FastJSONResponse(content, headers={**(headers or {}), **REVALIDATE_HEADERS, "ETag": etag})
+
+def next_page_link(request: Request, **params) -> Dict[str, str]:
+    """Link header pointing at the next page: the current query with the cursor params replaced"""
+    query = {**request.query_params, **params}
+    return {"Link": f'<{request.url.path}?{urlencode(query)}>; rel="next"'}
+
+async def load_habit_stats(user_id: str, version: int, habits: List[dict], today: date) -> Dict[str, dict]:
+    """Per-habit stats served from the stats cache, computing only the habits that miss"""
+    stats_cache = Database.get_stats_cache()
+    keys = {habit["_id"]: habit_stats_key(user_id, version, habit["_id"], today) for habit in habits}
+    cached = await stats_cache.get_many(list(keys.values()))
+    stats_by_habit = {habit_id: cached[key] for habit_id, key in keys.items() if key in cached}
+    
+    missing = [habit_id for habit_id in keys if habit_id not in stats_by_habit]
+    if missing:
+        # Materialized stats carry all-time streaks and the recent dates for window rates
+        documents = await Database.get_habit_stats_documents(user_id, missing)
+        completions = [
+            {"habit_id": habit_id, "date": date_str, "completed": True}
+            for habit_id, document in documents.items()
+            for date_str in document["recent_dates"]
+        ]
+        computed = compute_habit_stats(missing, completions, today, STATS_WINDOW_DAYS)
+        for habit_id in missing:
+            document = documents[habit_id]
+            computed[habit_id]["current_streak"] = streak_from_run(
+                document["last_completed_date"], document["current_run"], today, document["recent_dates"]
+            )
+            computed[habit_id]["longest_streak"] = document["longest_streak"]
+        
+        await stats_cache.set_many({keys[habit_id]: computed[habit_id] for habit_id in missing})
+        stats_by_habit.update(computed)
+    
+    return stats_by_habit
+
 # Habit management endpoints
 @api_router.get("/habits", response_model=List[HabitResponse])
-async def get_habits(current_user: dict = Depends(get_current_user)):
-    """Get all habits for the current user"""
-    habits = await Database.get_user_habits(current_user["_id"])
+async def get_habits(
+    request: Request,
+    after_id: Optional[str] = None,
+    limit: int = Query(HABITS_PAGE_DEFAULT, ge=1, le=HABITS_PAGE_MAX),
+    current_user: dict = Depends(get_current_user)
+):
+    """Get a page of the current user's habits in creation order; a Link header points at the next page"""
+    today = user_today(current_user)
+    version = await Database.get_data_version(current_user["_id"])
+    etag = data_etag(request, version, today)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
     
-    # Add stats to each habit
+    habits = await Database.get_user_habits_page(current_user["_id"], after_id, limit + 1)
+    if habits is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unknown after_id cursor"
+        )
+    headers = {}
+    if len(habits) > limit:
+        habits = habits[:limit]
+        headers = next_page_link(request, after_id=habits[-1]["_id"])
+    
+    stats_by_habit = await load_habit_stats(current_user["_id"], version, habits, today)
+    
+    # Add stats to each habit; the dicts already match HabitResponse, so skip model validation
     habits_with_stats = []
     for habit in habits:
-        completions = await Database.get_habit_completions(habit["_id"], current_user["_id"])
-        habit_with_stats = format_habit_stats(habit, completions)
-        habits_with_stats.append(HabitResponse(**habit_with_stats))
+        habit_with_stats = format_habit_stats(habit, [], stats_by_habit[habit["_id"]])
+        habit_with_stats["notification"] = {**NOTIFICATION_DEFAULTS, **(habit_with_stats["notification"] or {})}
+        habits_with_stats.append(habit_with_stats)
     
-    return habits_with_stats
+    return etag_response(habits_with_stats, etag, headers)
 
 @api_router.post("/habits", response_model=HabitResponse)
 async def create_habit(
@@ -116,7 +264,7 @@ async def create_habit(
     habit_data["user_id"] = current_user["_id"]
     habit_data["_id"] = str(uuid.uuid4())
     
-    habit = await Database.create_habit(habit_data)
+    habit = await Database.create_habit(habit_data, current_user.get("timezone") or "UTC")
     
     return HabitResponse(
         id=habit["_id"],
@@ -143,11 +291,19 @@ async def update_habit(
     
     # Update habit
     update_data = {k: v for k, v in habit_update.dict().items() if v is not None}
-    await Database.update_habit(habit_id, current_user["_id"], update_data)
+    await Database.update_habit(
+        habit_id, current_user["_id"], update_data, current_user.get("timezone") or "UTC"
+    )
     
     # Return updated habit
     updated_habit = await Database.get_habit_by_id(habit_id, current_user["_id"])
-    return HabitResponse(**updated_habit)
+    return HabitResponse(
+        id=updated_habit["_id"],
+        name=updated_habit["name"],
+        category=updated_habit["category"],
+        notification=updated_habit["notification"],
+        created_at=updated_habit["created_at"]
+    )
 
 @api_router.delete("/habits/{habit_id}")
 async def delete_habit(
@@ -173,68 +329,145 @@ async def toggle_habit_completion(
 ):
     """Toggle habit completion for a specific date"""
     # Check if habit exists and belongs to user
-    habit = await Database.get_habit_by_id(habit_id, current_user["_id"])
-    if not habit:
+    if not await Database.habit_belongs_to_user(habit_id, current_user["_id"]):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Habit not found"
         )
     
-    # Get current completion status
-    existing_completion = await Database.get_completion(
+    # Toggle completion in a single atomic update
+    new_status = await Database.toggle_completion(
         habit_id, current_user["_id"], completion_toggle.date
     )
     
-    # Toggle completion
-    new_status = not (existing_completion and existing_completion.get("completed", False))
-    await Database.update_completion(
-        habit_id, current_user["_id"], completion_toggle.date, new_status
+    return {"date": completion_toggle.date, "completed": new_status}
+
+@api_router.post("/completions/batch", response_model=CompletionBatchResponse)
+async def batch_update_completions(
+    batch: CompletionBatchRequest,
+    current_user: dict = Depends(get_current_user)
+):
+    """Set completion status for many habits and dates at once (offline sync and backfill)"""
+    # Check ownership of every referenced habit with one query
+    owned_habit_ids = await Database.get_user_habit_ids(
+        current_user["_id"], {item.habit_id for item in batch.items}
     )
     
-    return {"date": completion_toggle.date, "completed": new_status}
+    # Later items for the same habit and date win, as if they had been sent one by one
+    latest_items = {}
+    for index, item in enumerate(batch.items):
+        if item.habit_id in owned_habit_ids:
+            latest_items[(item.habit_id, item.date)] = index
+    write_indexes = sorted(latest_items.values())
+    
+    errors = await Database.bulk_update_completions(
+        current_user["_id"], [batch.items[index].dict() for index in write_indexes]
+    )
+    errors_by_key = {
+        (batch.items[write_indexes[position]].habit_id, batch.items[write_indexes[position]].date): message
+        for position, message in errors.items()
+    }
+    
+    results = []
+    for item in batch.items:
+        if item.habit_id not in owned_habit_ids:
+            results.append(CompletionBatchResult(**item.dict(), status="not_found", error="Habit not found"))
+        elif (item.habit_id, item.date) in errors_by_key:
+            results.append(CompletionBatchResult(
+                **item.dict(), status="error", error=errors_by_key[(item.habit_id, item.date)]
+            ))
+        else:
+            results.append(CompletionBatchResult(**item.dict(), status="ok"))
+    
+    return CompletionBatchResponse(results=results)
 
 @api_router.get("/habits/{habit_id}/completions")
 async def get_habit_completions(
+    request: Request,
     habit_id: str,
-    days: int = 30,
+    days: int = Query(30, ge=1, le=STATS_WINDOW_DAYS),
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    after_date: Optional[date] = None,
+    limit: int = Query(COMPLETIONS_PAGE_MAX, ge=1, le=COMPLETIONS_PAGE_MAX),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get completion history for a habit"""
+    """Get completion history for a habit between start and end (default: the last `days` days), newest first"""
     # Check if habit exists and belongs to user
-    habit = await Database.get_habit_by_id(habit_id, current_user["_id"])
-    if not habit:
+    if not await Database.habit_belongs_to_user(habit_id, current_user["_id"]):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Habit not found"
         )
     
-    completions = await Database.get_habit_completions(habit_id, current_user["_id"], days)
+    today = user_today(current_user)
+    version = await Database.get_data_version(current_user["_id"])
+    etag = data_etag(request, version, today)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
+    end = end or today
+    start = start or end - timedelta(days=days - 1)
+    if start > end:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="start must not be after end"
+        )
+    page_end = min(end, after_date - timedelta(days=1)) if after_date else end
     
     # Format completions as dict with date keys
     completions_dict = {}
-    for completion in completions:
+    async for completion in Database.iter_habit_completions(
+        habit_id, current_user["_id"], start.isoformat(), page_end.isoformat(), limit + 1
+    ):
         completions_dict[completion["date"]] = completion["completed"]
     
-    return {
+    next_after_date = None
+    if len(completions_dict) > limit:
+        completions_dict.popitem()
+        next_after_date = next(reversed(completions_dict))
+    
+    # The rate covers the whole range, which a single page may not
+    if after_date or next_after_date:
+        completed_in_range = await Database.count_habit_completions(
+            habit_id, current_user["_id"], start.isoformat(), end.isoformat()
+        )
+    else:
+        completed_in_range = sum(1 for completed in completions_dict.values() if completed)
+    
+    # The streak can reach back past the requested range, so read it from the materialized stats
+    stats_document = (await Database.get_habit_stats_documents(current_user["_id"], [habit_id])).get(habit_id, {})
+    
+    headers = next_page_link(request, after_date=next_after_date) if next_after_date else None
+    return etag_response({
         "habit_id": habit_id,
         "completions": completions_dict,
+        "next_after_date": next_after_date,
         "stats": {
-            "current_streak": calculate_current_streak(completions),
-            "completion_rate": calculate_completion_rate(completions, days)
+            "current_streak": streak_from_run(
+                stats_document.get("last_completed_date"), stats_document.get("current_run", 0), today,
+                stats_document.get("recent_dates")
+            ),
+            "completion_rate": round((completed_in_range / ((end - start).days + 1)) * 100, 1)
         }
-    }
+    }, etag, headers)
 
 @api_router.get("/habits/stats", response_model=OverallStats)
-async def get_overall_stats(current_user: dict = Depends(get_current_user)):
+async def get_overall_stats(request: Request, current_user: dict = Depends(get_current_user)):
     """Get overall statistics for all user habits"""
+    today = user_today(current_user)
+    version = await Database.get_data_version(current_user["_id"])
+    etag = data_etag(request, version, today)
+    unchanged = not_modified(request, etag)
+    if unchanged:
+        return unchanged
+    
     habits = await Database.get_user_habits(current_user["_id"])
-    today = date.today().isoformat()
     
-    # Get today's completions
-    today_completions = await Database.get_user_completions_for_date(
-        current_user["_id"], today
-    )
-    completed_today = len(today_completions)
+    stats = calculate_habits_stats(habits, await load_habit_stats(current_user["_id"], version, habits, today))
+    
+    completed_today = stats["completed_today"]
     total_habits = len(habits)
     
     # Calculate overall completion rate
@@ -242,23 +475,17 @@ async def get_overall_stats(current_user: dict = Depends(get_current_user)):
         (completed_today / total_habits * 100) if total_habits > 0 else 0
     )
     
-    # Get stats for each habit
-    habits_stats = []
-    for habit in habits:
-        completions = await Database.get_habit_completions(habit["_id"], current_user["_id"])
-        stats = HabitStats(
-            habit_id=habit["_id"],
-            current_streak=calculate_current_streak(completions),
-            completion_rate=calculate_completion_rate(completions)
-        )
-        habits_stats.append(stats)
+    habits_stats = [
+        {field: habit_stats[field] for field in HABIT_STATS_FIELDS if field in habit_stats}
+        for habit_stats in stats["habits_stats"]
+    ]
     
-    return OverallStats(
-        total_habits=total_habits,
-        completed_today=completed_today,
-        today_completion_rate=round(today_completion_rate, 1),
-        habits_stats=habits_stats
-    )
+    return etag_response({
+        "total_habits": total_habits,
+        "completed_today": completed_today,
+        "today_completion_rate": round(today_completion_rate, 1),
+        "habits_stats": habits_stats
+    }, etag)
 
 # Notification endpoints
 @api_router.post("/notifications/subscribe")
@@ -284,13 +511,16 @@ async def send_test_notification(
     current_user: dict = Depends(get_current_user)
 ):
     """Send a test notification to user"""
-    subscription = current_user.get("notification_subscription")
+    subscriptions = await Database.get_notification_subscriptions([current_user["_id"]])
+    subscription = subscriptions.get(current_user["_id"])
     if not subscription:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User not subscribed to notifications"
         )
     
+    from notifications import NotificationService
+    
     payload = NotificationService.create_test_notification_payload(request.message)
     success = await NotificationService.send_notification(subscription, payload)
     
@@ -302,49 +532,183 @@ async def send_test_notification(
             detail="Failed to send test notification"
         )
 
+# Export endpoint
+# Documents fetched per cursor round trip and bytes buffered per streamed chunk
+EXPORT_BATCH_SIZE = 1000
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_CSV_COLUMNS = ["habit_id", "habit_name", "category", "date", "completed"]
+
+async def export_lines(user_id: str, export_format: str) -> AsyncIterator[bytes]:
+    """Encoded export records; only the habits are held in memory, completions stream from the cursor"""
+    habits = {}
+    async for habit in Database.iter_user_habits(user_id, EXPORT_BATCH_SIZE):
+        habits[habit["_id"]] = habit
+        if export_format == "ndjson":
+            yield orjson.dumps({
+                "type": "habit",
+                "id": habit["_id"],
+                "name": habit["name"],
+                "category": habit["category"],
+                "notification": habit.get("notification"),
+                "created_at": habit["created_at"]
+            }) + b"\n"
+    
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_CSV_COLUMNS)
+        yield buffer.getvalue().encode()
+    
+    exported_habit_ids = set()
+    async for completion in Database.iter_user_completions(user_id, EXPORT_BATCH_SIZE):
+        if export_format == "ndjson":
+            yield orjson.dumps({"type": "completion", **completion}) + b"\n"
+        else:
+            habit = habits.get(completion["habit_id"], {})
+            exported_habit_ids.add(completion["habit_id"])
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow([
+                completion["habit_id"], habit.get("name", ""), habit.get("category", ""),
+                completion["date"], "true" if completion["completed"] else "false"
+            ])
+            yield buffer.getvalue().encode()
+    
+    if export_format == "csv":
+        # Habits without any completion get one row with empty date and completed columns
+        for habit_id, habit in habits.items():
+            if habit_id not in exported_habit_ids:
+                buffer.seek(0)
+                buffer.truncate()
+                writer.writerow([habit_id, habit["name"], habit["category"], "", ""])
+                yield buffer.getvalue().encode()
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """Whether an Accept-Encoding header allows gzip, honouring q-values (gzip;q=0 refuses it)"""
+    qualities = {}
+    for coding in accept_encoding.lower().split(","):
+        name, _, params = coding.partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip()] = quality
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+async def export_chunks(lines: AsyncIterator[bytes], compress: bool) -> AsyncIterator[bytes]:
+    """Group lines into EXPORT_CHUNK_BYTES chunks, gzipping them on the fly when asked to"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    pending = []
+    pending_bytes = 0
+    async for line in lines:
+        pending.append(line)
+        pending_bytes += len(line)
+        if pending_bytes >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(pending)
+            pending = []
+            pending_bytes = 0
+            chunk = compressor.compress(chunk) if compressor else chunk
+            if chunk:
+                yield chunk
+    
+    chunk = b"".join(pending)
+    if compressor:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+@api_router.get("/export")
+async def export_history(
+    request: Request,
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Stream the user's habits and full completion history as NDJSON or CSV, gzipped if accepted"""
+    compress = accepts_gzip(request.headers.get("accept-encoding", ""))
+    filename = f"habit-history-{user_today(current_user).isoformat()}.{export_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    
+    media_type = "application/x-ndjson" if export_format == "ndjson" else "text/csv; charset=utf-8"
+    return StreamingResponse(
+        export_chunks(export_lines(current_user["_id"], export_format), compress),
+        media_type=media_type,
+        headers=headers
+    )
+
 # Health check endpoint
 @api_router.get("/")
 async def root():
     return {"message": "Habit Tracker API is running"}
 
-# Include the router in the main app
-app.include_router(api_router)
+@api_router.get("/metrics")
+async def get_metrics(request: Request):
+    """Request latency and MongoDB command metrics in the Prometheus text format"""
+    metrics_token = os.environ.get("METRICS_TOKEN")
+    if metrics_token and request.headers.get("authorization") != f"Bearer {metrics_token}":
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token"
+        )
+    return Response(render_metrics(), media_type=PROMETHEUS_CONTENT_TYPE)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def record_request_metrics(request: Request, call_next):
+    return await track_request(request, call_next)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+async def prepare_database():
+    try:
+        await Database.ensure_indexes()
+        await Database.explain_query_shapes()
+    except Exception as e:
+        logger.error(f"Failed to prepare database indexes: {e}")
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    if Database.client:
-        Database.client.close()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the database and background services for the app's lifetime"""
+    Database.initialize()
+    # Index builds and plan checks are round trips; serve while they run
+    prepare_task = asyncio.create_task(prepare_database())
+    
+    reminder_scheduler = None
+    if os.environ.get("REMINDER_SCHEDULER_ENABLED", "true").lower() == "true":
+        from scheduler import ReminderScheduler
+        reminder_scheduler = ReminderScheduler()
+        reminder_scheduler.start()
+    
+    yield
+    
+    prepare_task.cancel()
+    if reminder_scheduler is not None:
+        await reminder_scheduler.stop()
+    Database.close()
+    # Only loaded if a push was sent
+    notifications = sys.modules.get("notifications")
+    if notifications is not None:
+        notifications.NotificationService.shutdown()
+    await close_http_client()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+def create_app() -> FastAPI:
+    app = FastAPI(title="Habit Tracker API", lifespan=lifespan)
+    app.include_router(api_router)
+    
+    # Middleware added later wraps earlier middleware: CORS, then metrics, then profiling.
+    # Profiling sits innermost so it runs in the endpoint's task.
+    if profiling_enabled():
+        app.add_middleware(ProfilingMiddleware)
+    app.middleware("http")(record_request_metrics)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["ETag", "Link"],
+    )
+    return app
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+app = create_app()
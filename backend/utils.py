@@ -1,6 +1,17 @@
-from datetime import datetime, date, timedelta
-from typing import List, Dict, Any
+from datetime import datetime, date, time, timedelta
+from functools import lru_cache
+from typing import List, Dict, Any, Tuple, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import calendar
+import logging
+
+logger = logging.getLogger(__name__)
+
+MINUTES_PER_WEEK = 7 * 24 * 60
+
+# Habit-year completion bitmaps: 6 words x 62 bits covers 366 days and keeps every mask a positive Int64
+BITMAP_WORDS = 6
+BITMAP_BITS_PER_WORD = 62
 
 def calculate_current_streak(completions: List[Dict[str, Any]], today_date: date = None) -> int:
     """Calculate current streak from completions list"""
@@ -10,62 +21,227 @@ def calculate_current_streak(completions: List[Dict[str, Any]], today_date: date
     if today_date is None:
         today_date = date.today()
     
-    # Sort completions by date descending
-    sorted_completions = sorted(completions, key=lambda x: x["date"], reverse=True)
+    # Index completion status by date once; the first entry for a date wins
+    status_by_date = {}
+    completed_dates = set()
+    for comp in completions:
+        status_by_date.setdefault(comp["date"], comp["completed"])
+        if comp["completed"]:
+            completed_dates.add(comp["date"])
     
     streak = 0
     current_date = today_date
     
     # Check if we need to start from yesterday if today is not completed
-    today_completed = any(
-        comp["date"] == today_date.isoformat() and comp["completed"] 
-        for comp in completions
-    )
-    
-    if not today_completed:
+    if today_date.isoformat() not in completed_dates:
         current_date = today_date - timedelta(days=1)
     
     # Count consecutive days
-    for i in range(len(sorted_completions)):
-        date_str = current_date.isoformat()
-        
-        # Find completion for current date
-        completion = next(
-            (comp for comp in sorted_completions if comp["date"] == date_str),
-            None
-        )
-        
-        if completion and completion["completed"]:
-            streak += 1
-            current_date -= timedelta(days=1)
-        else:
-            break
+    while status_by_date.get(current_date.isoformat()):
+        streak += 1
+        current_date -= timedelta(days=1)
     
     return streak
 
-def calculate_completion_rate(completions: List[Dict[str, Any]], days: int = 30) -> float:
+def calculate_completion_rate(
+    completions: List[Dict[str, Any]],
+    days: int = 30,
+    today_date: date = None
+) -> float:
     """Calculate completion rate percentage for given number of days"""
     if not completions or days <= 0:
         return 0.0
     
-    today = date.today()
+    completed_dates = {comp["date"] for comp in completions if comp["completed"]}
+    
+    today = today_date or date.today()
     completed_count = 0
     
     for i in range(days):
         check_date = today - timedelta(days=i)
-        date_str = check_date.isoformat()
-        
-        # Check if this date was completed
-        completed = any(
-            comp["date"] == date_str and comp["completed"] 
-            for comp in completions
-        )
-        
-        if completed:
+        if check_date.isoformat() in completed_dates:
             completed_count += 1
     
     return round((completed_count / days) * 100, 1)
 
+def valid_dates(date_strs: List[str]) -> List[str]:
+    """The YYYY-MM-DD strings that parse as dates; a malformed stored date is logged and skipped"""
+    valid = []
+    for date_str in date_strs:
+        try:
+            date.fromisoformat(date_str)
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping completion with invalid date: {date_str!r}")
+            continue
+        valid.append(date_str)
+    return valid
+
+def summarize_completion_history(completed_dates: List[str]) -> Dict[str, Any]:
+    """Summarize an ascending list of distinct completed dates into streak counters"""
+    last_completed = None
+    current_run = 0
+    longest_streak = 0
+    total_completions = 0
+    
+    for date_str in completed_dates:
+        try:
+            day = date.fromisoformat(date_str)
+        except (TypeError, ValueError):
+            logger.warning(f"Skipping completion with invalid date: {date_str!r}")
+            continue
+        total_completions += 1
+        if last_completed is not None and day - last_completed == timedelta(days=1):
+            current_run += 1
+        else:
+            current_run = 1
+        longest_streak = max(longest_streak, current_run)
+        last_completed = day
+    
+    return {
+        "last_completed_date": last_completed.isoformat() if last_completed else None,
+        "current_run": current_run,
+        "longest_streak": longest_streak,
+        "total_completions": total_completions
+    }
+
+def update_completion_summary(
+    summary: Dict[str, Any],
+    date_str: str,
+    completed: bool,
+    recent_start: str
+) -> Optional[Dict[str, Any]]:
+    """Fold one checked or unchecked day into a summary whose recent_dates hold every completed day since recent_start"""
+    # Returns {} when nothing changed and None when the answer depends on days before recent_start
+    if date_str < recent_start:
+        return None
+    recent = {recent_date for recent_date in summary["recent_dates"] if recent_date >= recent_start}
+    if (date_str in recent) == completed:
+        return {}
+    
+    window_start = date.fromisoformat(recent_start)
+    one_day = timedelta(days=1)
+    
+    def run_start(day: date) -> date:
+        while (day - one_day).isoformat() in recent:
+            day -= one_day
+        return day
+    
+    def run_bounds(day: date) -> Optional[Tuple[date, date]]:
+        """First and last day of the run through day, None if it may reach back before the window"""
+        start = run_start(day)
+        end = day
+        while (end + one_day).isoformat() in recent:
+            end += one_day
+        return None if start <= window_start else (start, end)
+    
+    day = date.fromisoformat(date_str)
+    last_completed = summary["last_completed_date"]
+    current_run = summary["current_run"]
+    longest_streak = summary["longest_streak"]
+    total_completions = summary["total_completions"] + (1 if completed else -1)
+    
+    if completed:
+        recent.add(date_str)
+        bounds = run_bounds(day)
+        if bounds is None:
+            return None
+        run_length = (bounds[1] - bounds[0]).days + 1
+        if last_completed is None or date_str > last_completed:
+            last_completed = date_str
+            current_run = run_length
+        elif bounds[1].isoformat() == last_completed:
+            # Joined the latest run
+            current_run = run_length
+        longest_streak = max(longest_streak, run_length)
+    else:
+        bounds = run_bounds(day)
+        if bounds is None:
+            return None
+        split_length = (bounds[1] - bounds[0]).days + 1
+        recent.discard(date_str)
+        if date_str == last_completed:
+            if day - one_day >= bounds[0]:
+                last_completed = (day - one_day).isoformat()
+                current_run = (day - bounds[0]).days
+            elif recent:
+                last_completed = max(recent)
+                latest_bounds = run_bounds(date.fromisoformat(last_completed))
+                if latest_bounds is None:
+                    return None
+                current_run = (latest_bounds[1] - latest_bounds[0]).days + 1
+            elif total_completions > 0:
+                return None  # The last completed day is before the window
+            else:
+                last_completed = None
+                current_run = 0
+        elif bounds[1].isoformat() == last_completed:
+            # Split the latest run; the part after the unchecked day remains
+            current_run = (bounds[1] - day).days
+        
+        if split_length >= longest_streak:
+            # The split run was a longest one; another run that long in the window keeps the record
+            run_lengths = (
+                (run_end - run_start(run_end)).days + 1
+                for run_end in map(date.fromisoformat, recent)
+                if (run_end + one_day).isoformat() not in recent
+            )
+            if longest_streak not in run_lengths:
+                return None
+    
+    return {
+        "last_completed_date": last_completed,
+        "current_run": current_run,
+        "longest_streak": longest_streak,
+        "total_completions": total_completions,
+        "recent_dates": sorted(recent)
+    }
+
+def streak_from_run(
+    last_completed_date: str,
+    current_run: int,
+    today_date: date = None,
+    recent_dates: List[str] = None
+) -> int:
+    """Current streak from the run ending at last_completed_date, as calculate_current_streak counts it"""
+    if not last_completed_date:
+        return 0
+    
+    if today_date is None:
+        today_date = date.today()
+    
+    last_completed = date.fromisoformat(last_completed_date)
+    days_since = (today_date - last_completed).days
+    if days_since >= 0:
+        return current_run if days_since <= 1 else 0
+    
+    # Days after today are completed (the user's day is ahead of the server's). If today is
+    # inside the latest run, count that run up to today; otherwise count back through recent_dates
+    if last_completed - timedelta(days=current_run - 1) <= today_date:
+        return current_run + days_since
+    return calculate_current_streak(
+        [{"date": date_str, "completed": True} for date_str in recent_dates or []],
+        today_date
+    )
+
+def bitmap_position(date_str: str) -> Tuple[int, str, int]:
+    """Year, word field and bit mask of a YYYY-MM-DD date in its habit-year bitmap"""
+    day = date.fromisoformat(date_str)
+    index = day.timetuple().tm_yday - 1
+    return day.year, f"w{index // BITMAP_BITS_PER_WORD}", 1 << (index % BITMAP_BITS_PER_WORD)
+
+def bitmap_dates(bitmap: Dict[str, Any]) -> List[str]:
+    """Completed dates, ascending, stored in one habit-year bitmap document"""
+    year_start = date(bitmap["year"], 1, 1)
+    dates = []
+    for word in range(BITMAP_WORDS):
+        value = bitmap.get(f"w{word}", 0)
+        while value:
+            lowest_bit = value & -value
+            index = word * BITMAP_BITS_PER_WORD + lowest_bit.bit_length() - 1
+            dates.append((year_start + timedelta(days=index)).isoformat())
+            value ^= lowest_bit
+    return dates
+
 def get_date_range(days: int) -> List[str]:
     """Get list of date strings for the last N days"""
     today = date.today()
@@ -77,13 +253,69 @@ def get_date_range(days: int) -> List[str]:
     
     return dates
 
-def is_notification_time(notification_settings: Dict[str, Any]) -> bool:
-    """Check if current time matches notification settings"""
+def is_valid_timezone(timezone: str) -> bool:
+    try:
+        ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return False
+    return True
+
+@lru_cache(maxsize=4096)
+def utc_offset_minutes(timezone: str, day: date) -> int:
+    """UTC offset of a zone at noon on day, in minutes; cached per (zone, day)"""
+    try:
+        zone = ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        return 0
+    offset = datetime.combine(day, time(12), tzinfo=zone).utcoffset()
+    return int(offset.total_seconds() // 60)
+
+def local_now(timezone: str = "UTC") -> datetime:
+    """Current wall-clock time in a zone, as a naive datetime"""
+    now = datetime.utcnow()
+    return now + timedelta(minutes=utc_offset_minutes(timezone, now.date()))
+
+def user_today(user: Dict[str, Any]) -> date:
+    """The user's local date, from the timezone stored on their profile"""
+    return local_now(user.get("timezone") or "UTC").date()
+
+def notification_weekday(day: date) -> int:
+    """Weekday in the NotificationSettings.days convention (Sunday = 0, as in JavaScript getDay)"""
+    return (day.weekday() + 1) % 7
+
+def reminder_slot(weekday: int, hour: int, minute: int) -> str:
+    """Scheduler bucket key for a weekday and time of day"""
+    return f"{weekday}-{hour:02d}:{minute:02d}"
+
+def reminder_slots(notification_settings: Dict[str, Any], offset_minutes: int = 0) -> List[str]:
+    """All UTC scheduler buckets a habit's local notification settings fire in"""
+    if not notification_settings or not notification_settings.get("enabled", False):
+        return []
+    
+    try:
+        time_parts = notification_settings.get("time", "09:00").split(":")
+        hour = int(time_parts[0])
+        minute = int(time_parts[1])
+    except (ValueError, IndexError):
+        return []
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        return []
+    
+    # Shift each local minute of the week to UTC; this can move it to another weekday
+    slots = set()
+    for day in notification_settings.get("days", []):
+        if 0 <= day <= 6:
+            utc_minute = (day * 24 * 60 + hour * 60 + minute - offset_minutes) % MINUTES_PER_WEEK
+            slots.add(reminder_slot(utc_minute // (24 * 60), utc_minute // 60 % 24, utc_minute % 60))
+    return sorted(slots)
+
+def is_notification_time(notification_settings: Dict[str, Any], timezone: str = "UTC") -> bool:
+    """Check if current time in the user's timezone matches notification settings"""
     if not notification_settings.get("enabled", False):
         return False
     
-    now = datetime.now()
-    current_weekday = now.weekday()  # Monday = 0
+    now = local_now(timezone)
+    current_weekday = notification_weekday(now.date())
     
     # Check if today is in notification days
     if current_weekday not in notification_settings.get("days", []):
@@ -103,10 +335,18 @@ def is_notification_time(notification_settings: Dict[str, Any]) -> bool:
     except (ValueError, IndexError):
         return False
 
-def format_habit_stats(habit: Dict[str, Any], completions: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Format habit with calculated stats"""
-    current_streak = calculate_current_streak(completions)
-    completion_rate = calculate_completion_rate(completions, 30)
+def format_habit_stats(
+    habit: Dict[str, Any],
+    completions: List[Dict[str, Any]],
+    stats: Dict[str, Any] = None,
+    today_date: date = None
+) -> Dict[str, Any]:
+    """Format habit with calculated stats, or with stats precomputed by the analytics module"""
+    if stats is None:
+        stats = {
+            "current_streak": calculate_current_streak(completions, today_date),
+            "completion_rate": calculate_completion_rate(completions, 30, today_date)
+        }
     
     return {
         "id": habit["_id"],
@@ -114,8 +354,23 @@ def format_habit_stats(habit: Dict[str, Any], completions: List[Dict[str, Any]])
         "category": habit["category"],
         "notification": habit.get("notification", {}),
         "created_at": habit["created_at"],
-        "stats": {
-            "current_streak": current_streak,
-            "completion_rate": completion_rate
-        }
-    }
\ No newline at end of file
+        "stats": stats
+    }
+
+def calculate_habits_stats(
+    habits: List[Dict[str, Any]],
+    stats_by_habit: Dict[str, Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Summarize today's progress and list per-habit stats computed by the analytics module"""
+    habits_stats = []
+    completed_today = 0
+    for habit in habits:
+        habit_stats = stats_by_habit[habit["_id"]]
+        if habit_stats.get("completed_today"):
+            completed_today += 1
+        habits_stats.append({"habit_id": habit["_id"], **habit_stats})
+    
+    return {
+        "completed_today": completed_today,
+        "habits_stats": habits_stats
+    }
@@ -52,7 +52,8 @@ export const AuthProvider = ({ children }) => {
   const loginWithGoogle = async (googleToken) => {
     try {
       const response = await axios.post(`${API}/auth/google`, {
-        token: googleToken
+        token: googleToken,
+        timezone: Intl.DateTimeFormat().resolvedOptions().timeZone
       });
 
       const { access_token, user: userData } = response.data;
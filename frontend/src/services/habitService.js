@@ -4,11 +4,20 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
 export const habitService = {
-  // Get all habits
+  // Get all habits, following the Link header across pages
   async getHabits() {
     try {
-      const response = await axios.get(`${API}/habits`);
-      return response.data;
+      const habits = [];
+      let afterId = null;
+      do {
+        const response = await axios.get(`${API}/habits`, {
+          params: afterId ? { after_id: afterId } : {}
+        });
+        habits.push(...response.data);
+        const next = /[?&]after_id=([^&>]+)[^>]*>;\s*rel="next"/.exec(response.headers.link || '');
+        afterId = next ? decodeURIComponent(next[1]) : null;
+      } while (afterId);
+      return habits;
     } catch (error) {
       console.error('Failed to fetch habits:', error);
       throw error;
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# Backend modules import each other by bare name (from database import Database)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+@pytest.fixture
+def mock_database():
+    """Point Database at an in-memory mongomock client for one test"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from database import Database
+    
+    Database.client = mongomock_motor.AsyncMongoMockClient()
+    Database.db = Database.client["test_database"]
+    yield Database
+    Database.client = None
+    Database.db = None
@@ -0,0 +1,54 @@
+import random
+from datetime import date, timedelta
+from typing import List, Dict, Any
+
+import numpy as np
+import pytest
+
+from analytics import ROLLING_WINDOWS, compute_habit_stats, weekday_completion_rates
+from utils import (
+    calculate_current_streak, calculate_completion_rate, summarize_completion_history, notification_weekday
+)
+
+def test_weekday_rates_use_notification_weekdays():
+    end_date = date(2024, 6, 15)
+    matrix = np.zeros((1, 14), dtype=bool)
+    # Complete every day of the second week except one, so each weekday column is identifiable
+    for offset in range(7):
+        day = end_date - timedelta(days=offset)
+        matrix[0, 13 - offset] = notification_weekday(day) != 3
+    
+    rates = weekday_completion_rates(matrix, end_date)[0]
+    
+    assert rates.tolist() == [50.0, 50.0, 50.0, 0.0, 50.0, 50.0, 50.0]
+
+def random_history(rng: random.Random, habit_id: str, today: date) -> List[Dict[str, Any]]:
+    """One stored row per day, as the unique completions index allows: runs, gaps and unchecked days"""
+    completions = []
+    day = today - timedelta(days=rng.randint(0, 3))
+    for _ in range(rng.randint(0, 200)):
+        completions.append({"habit_id": habit_id, "date": day.isoformat(), "completed": rng.random() < 0.8})
+        day -= timedelta(days=1 if rng.random() < 0.85 else rng.randint(2, 10))
+        if day <= today - timedelta(days=365):
+            break
+    rng.shuffle(completions)
+    return completions
+
+@pytest.mark.parametrize("seed", range(100))
+def test_compute_habit_stats_matches_utils_kernels(seed):
+    rng = random.Random(seed)
+    today = date.today()
+    habit_ids = [f"h{index}" for index in range(rng.randint(1, 15))]
+    histories = {habit_id: random_history(rng, habit_id, today) for habit_id in habit_ids}
+    completions = [completion for history in histories.values() for completion in history]
+    rng.shuffle(completions)
+    
+    stats = compute_habit_stats(habit_ids, completions, today, 365)
+    
+    for habit_id, history in histories.items():
+        completed_dates = sorted(completion["date"] for completion in history if completion["completed"])
+        assert stats[habit_id]["current_streak"] == calculate_current_streak(history, today)
+        assert stats[habit_id]["longest_streak"] == summarize_completion_history(completed_dates)["longest_streak"]
+        assert stats[habit_id]["completion_rate"] == calculate_completion_rate(history, 30, today)
+        for window in ROLLING_WINDOWS:
+            assert stats[habit_id]["rolling_rates"][window] == calculate_completion_rate(history, window, today)
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+from fastapi import HTTPException
+
+import auth
+
+class GoogleStub:
+    """Local tokeninfo/userinfo server recording each request and how many overlapped"""
+    
+    def __init__(self):
+        self.tokeninfo_status = 200
+        self.userinfo_status = 200
+        self.expires_in = 3600
+        self.delay = 0.0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                with stub.lock:
+                    stub.requests.append(url.path)
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                if url.path == "/tokeninfo":
+                    token = parse_qs(url.query)["access_token"][0]
+                    status, body = stub.tokeninfo_status, {"aud": "client", "sub": token, "expires_in": stub.expires_in}
+                else:
+                    token = self.headers["Authorization"].removeprefix("Bearer ")
+                    status, body = stub.userinfo_status, {
+                        "id": f"google-{token}", "email": f"{token}@example.com", "name": token, "picture": None
+                    }
+                with stub.lock:
+                    stub.in_flight -= 1
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, format, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+@pytest.fixture
+def google_stub(monkeypatch):
+    stub = GoogleStub()
+    monkeypatch.setattr(auth, "GOOGLE_TOKENINFO_URL", f"{stub.url}/tokeninfo")
+    monkeypatch.setattr(auth, "GOOGLE_USERINFO_URL", f"{stub.url}/userinfo")
+    auth.google_token_cache.clear()
+    yield stub
+    auth.google_token_cache.clear()
+    stub.close()
+
+def run(coroutine):
+    """Run on a fresh loop, closing the pooled client that was bound to it"""
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await auth.close_http_client()
+    return asyncio.run(main())
+
+def test_verifies_token_and_fetches_profile_concurrently(google_stub):
+    google_stub.delay = 0.3
+    
+    started = time.monotonic()
+    user = run(auth.verify_google_token("alice"))
+    elapsed = time.monotonic() - started
+    
+    assert user == {"google_id": "google-alice", "email": "alice@example.com", "name": "alice", "picture": None}
+    assert sorted(google_stub.requests) == ["/tokeninfo", "/userinfo"]
+    assert google_stub.max_in_flight == 2
+    assert elapsed < 0.55
+
+def test_concurrent_logins_share_the_client(google_stub):
+    google_stub.delay = 0.1
+    tokens = [f"user{index}" for index in range(10)]
+    
+    async def login_all():
+        return await asyncio.gather(*(auth.verify_google_token(token) for token in tokens))
+    
+    users = run(login_all())
+    
+    assert [user["google_id"] for user in users] == [f"google-{token}" for token in tokens]
+    assert len(google_stub.requests) == 20
+
+def test_repeated_token_is_served_from_cache(google_stub):
+    async def login_twice():
+        first = await auth.verify_google_token("bob")
+        first["name"] = "changed by caller"
+        return first, await auth.verify_google_token("bob")
+    
+    first, second = run(login_twice())
+    
+    assert len(google_stub.requests) == 2
+    assert second["name"] == "bob"
+
+def test_cache_ttl_is_capped_by_expires_in(google_stub):
+    google_stub.expires_in = 5
+    run(auth.verify_google_token("carol"))
+    token_hash = hashlib.sha256(b"carol").hexdigest()
+    expires_at, _ = auth.google_token_cache._entries[token_hash]
+    
+    assert expires_at - time.monotonic() <= 5
+    
+    google_stub.expires_in = 0
+    run(auth.verify_google_token("dave"))
+    
+    assert hashlib.sha256(b"dave").hexdigest() not in auth.google_token_cache._entries
+
+@pytest.mark.parametrize("tokeninfo_status, userinfo_status, detail", [
+    (400, 200, "Invalid Google token"),
+    (200, 401, "Could not fetch user profile"),
+])
+def test_rejected_tokens_raise_401(google_stub, tokeninfo_status, userinfo_status, detail):
+    google_stub.tokeninfo_status = tokeninfo_status
+    google_stub.userinfo_status = userinfo_status
+    
+    with pytest.raises(HTTPException) as error:
+        run(auth.verify_google_token("mallory"))
+    
+    assert error.value.status_code == 401
+    assert error.value.detail == detail
+    assert len(auth.google_token_cache) == 0
+
+def test_unreachable_google_raises_401(google_stub):
+    google_stub.close()
+    
+    with pytest.raises(HTTPException) as error:
+        run(auth.verify_google_token("eve"))
+    
+    assert error.value.status_code == 401
+    assert error.value.detail == "Could not verify Google token"
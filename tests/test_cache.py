@@ -0,0 +1,55 @@
+import asyncio
+from datetime import date
+
+import pytest
+
+from cache import MemoryCacheBackend, RedisCacheBackend, TTLCache, habit_stats_key
+
+fakeredis = pytest.importorskip("fakeredis")
+
+def test_ttl_cache_expires_and_evicts():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2, ttl=-1)
+    cache.set("c", 3)
+    
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+def test_stats_key_changes_with_data_version():
+    day = date(2024, 6, 1)
+    
+    assert habit_stats_key("u1", 4, "h1", day) != habit_stats_key("u1", 5, "h1", day)
+
+def test_memory_backend_round_trip():
+    async def run():
+        backend = MemoryCacheBackend()
+        await backend.set_many({"a": {"current_streak": 3}})
+        return await backend.get_many(["a", "b"])
+    
+    assert asyncio.run(run()) == {"a": {"current_streak": 3}}
+
+def test_redis_backend_round_trip_with_ttl():
+    async def run():
+        client = fakeredis.FakeAsyncRedis()
+        backend = RedisCacheBackend(client, ttl=120)
+        await backend.set_many({"a": {"current_streak": 3, "rolling_rates": {"7": 42.9}}})
+        values = await backend.get_many(["a", "b"])
+        return values, await client.ttl("a")
+    
+    values, ttl = asyncio.run(run())
+    
+    assert values == {"a": {"current_streak": 3, "rolling_rates": {"7": 42.9}}}
+    assert 0 < ttl <= 120
+
+def test_redis_errors_read_as_misses():
+    async def run():
+        server = fakeredis.FakeServer()
+        backend = RedisCacheBackend(fakeredis.FakeAsyncRedis(server=server))
+        await backend.set_many({"a": 1})
+        server.connected = False
+        await backend.set_many({"b": 2})
+        return await backend.get_many(["a", "b"])
+    
+    assert asyncio.run(run()) == {}
@@ -0,0 +1,281 @@
+import asyncio
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+from pymongo import IndexModel
+
+from database import Database
+
+pytestmark = pytest.mark.usefixtures("mock_database")
+
+def completion(_id: str, date_str: str, completed: bool, written_day: int) -> dict:
+    return {
+        "_id": _id, "habit_id": "h1", "user_id": "u1", "date": date_str,
+        "completed": completed, "created_at": datetime(2024, 1, written_day)
+    }
+
+def test_ensure_indexes_continues_past_a_failing_collection():
+    async def run():
+        await Database.get_collection('completions').insert_many([
+            completion("a", "2024-01-01", True, 1),
+            completion("b", "2024-01-01", False, 2),
+        ])
+        await Database.get_collection('habits').create_indexes([IndexModel([("user_id", 1)], name="user_id")])
+        
+        failed = await Database.ensure_indexes()
+        habit_indexes = await Database.get_collection('habits').index_information()
+        stats_indexes = await Database.get_collection('habit_stats').index_information()
+        return failed, habit_indexes, stats_indexes
+    
+    failed, habit_indexes, stats_indexes = asyncio.run(run())
+    
+    assert failed == ["completions"]
+    assert "user_id" not in habit_indexes
+    assert "user_created_at" in habit_indexes
+    assert "user_id" in stats_indexes
+
+def test_dedupe_completions_keeps_latest_write():
+    async def run():
+        await Database.get_collection('completions').insert_many([
+            completion("a", "2024-01-01", True, 1),
+            completion("b", "2024-01-01", False, 3),
+            completion("c", "2024-01-02", True, 2),
+            completion("d", "2024-01-02", True, 1),
+        ])
+        removed = await Database.dedupe_completions()
+        remaining = [doc["_id"] async for doc in Database.get_collection('completions').find({}).sort("_id", 1)]
+        failed = await Database.ensure_indexes()
+        stats = await Database.get_collection('habit_stats').find_one({"_id": "h1"})
+        return removed, remaining, failed, stats
+    
+    removed, remaining, failed, stats = asyncio.run(run())
+    
+    assert removed == 2
+    assert remaining == ["b", "c"]
+    assert failed == []
+    assert stats["total_completions"] == 1
+
+def test_rebuild_habit_stats_skips_invalid_stored_dates():
+    async def run():
+        await Database.get_collection('completions').insert_many([
+            completion("a", "2024-02-28", True, 1),
+            completion("b", "2024-02-30", True, 1),
+            completion("c", "2024-02-29", True, 1),
+        ])
+        return await Database.rebuild_habit_stats("h1", "u1")
+    
+    stats = asyncio.run(run())
+    
+    assert stats["last_completed_date"] == "2024-02-29"
+    assert stats["current_run"] == 2
+    assert stats["total_completions"] == 2
+
+def test_completion_changes_keep_stats_equal_to_a_rebuild(monkeypatch):
+    rebuilds = []
+    rebuild = Database.rebuild_habit_stats_documents
+    
+    async def counted_rebuild(user_id, habit_ids):
+        rebuilds.append(list(habit_ids))
+        return await rebuild(user_id, habit_ids)
+    
+    monkeypatch.setattr(Database, "rebuild_habit_stats_documents", staticmethod(counted_rebuild))
+    rng = random.Random(7)
+    today = date.today()
+    
+    async def run():
+        await Database.get_collection('users').insert_one({"_id": "u1", "data_version": 0})
+        await Database.rebuild_habit_stats("h1", "u1")
+        for _ in range(300):
+            date_str = (today - timedelta(days=rng.randint(-1, 60))).isoformat()
+            await Database.update_completion("h1", "u1", date_str, rng.random() < 0.6)
+        incremental = await Database.get_collection('habit_stats').find_one({"_id": "h1"}, {"updated_at": 0})
+        rebuilt = await rebuild("u1", ["h1"])
+        user = await Database.get_collection('users').find_one({"_id": "u1"})
+        return incremental, rebuilt["h1"], user["data_version"]
+    
+    incremental, rebuilt, data_version = asyncio.run(run())
+    
+    del rebuilt["updated_at"]
+    # The rebuild is one more stats write, so only the revision moves on
+    assert rebuilt.pop("revision") == incremental.pop("revision") + 1
+    assert incremental == rebuilt
+    assert 0 < data_version <= 300
+    # Most changes are folded in from recent_dates instead of rebuilding
+    assert len(rebuilds) < 30
+
+def test_rebuild_retries_when_stats_change_between_read_and_write(monkeypatch):
+    get_collection = Database.get_collection.__func__
+    raced = []
+    
+    def racing_get_collection(cls, name):
+        collection = get_collection(cls, name)
+        if name != 'habit_stats' or raced:
+            return collection
+        bulk_write = collection.bulk_write
+        
+        async def write_after_a_concurrent_check_in(operations, **kwargs):
+            raced.append(True)
+            await Database.update_completion("h1", "u1", date.today().isoformat(), True)
+            return await bulk_write(operations, **kwargs)
+        
+        collection.bulk_write = write_after_a_concurrent_check_in
+        return collection
+    
+    async def run():
+        await Database.get_collection('users').insert_one({"_id": "u1", "data_version": 0})
+        await Database.update_completion("h1", "u1", (date.today() - timedelta(days=1)).isoformat(), True)
+        monkeypatch.setattr(Database, "get_collection", classmethod(racing_get_collection))
+        rebuilt = await Database.rebuild_habit_stats_documents("u1", ["h1"])
+        stored = await Database.get_collection('habit_stats').find_one({"_id": "h1"})
+        return rebuilt["h1"], stored
+    
+    rebuilt, stored = asyncio.run(run())
+    
+    assert raced
+    # The stale pass lost the race and the retry saw the concurrent check-in
+    assert rebuilt["total_completions"] == stored["total_completions"] == 2
+    assert rebuilt["revision"] == stored["revision"]
+
+def test_bulk_update_rebuilds_all_habits_with_one_query():
+    async def run():
+        items = [
+            {"habit_id": habit_id, "date": f"2024-01-0{day}", "completed": True}
+            for habit_id in ("h1", "h2", "h3")
+            for day in range(1, 4)
+        ]
+        errors = await Database.bulk_update_completions("u1", items)
+        documents = await Database.get_habit_stats_documents("u1", ["h1", "h2", "h3", "h4"])
+        return errors, documents
+    
+    errors, documents = asyncio.run(run())
+    
+    assert errors == {}
+    assert {habit_id: document["longest_streak"] for habit_id, document in documents.items()} == {
+        "h1": 3, "h2": 3, "h3": 3, "h4": 0
+    }
+
+def test_migration_sets_checked_and_clears_unchecked_days(monkeypatch):
+    # mongomock has no $bit, so record the bulk writes instead of applying them
+    written = []
+    
+    class RecordingCollection:
+        async def bulk_write(self, operations, ordered=True):
+            written.extend(operation._doc["$bit"] for operation in operations)
+    
+    get_collection = Database.get_collection
+    monkeypatch.setattr(Database, "get_collection", classmethod(
+        lambda cls, name: RecordingCollection() if name == 'completion_bitmaps' else get_collection(name)
+    ))
+    
+    async def run():
+        await Database.get_collection('completions').insert_many([
+            completion("a", "2024-01-01", True, 1),
+            completion("b", "2024-01-02", False, 1),
+        ])
+        return await Database.migrate_completions_to_bitmaps()
+    
+    migrated = asyncio.run(run())
+    
+    assert migrated == 2
+    assert written == [{"w0": {"or": 1}}, {"w0": {"and": ~2}}]
+
+def test_refresh_reminder_slots_writes_every_habit_across_batches():
+    async def run():
+        habits = Database.get_collection('habits')
+        await habits.insert_many([
+            {"_id": f"h{i}", "user_id": "u1", "notification": {"enabled": True, "time": "08:30"}}
+            for i in range(5)
+        ])
+        updated = await Database.refresh_reminder_slots({"user_id": "u1"}, "UTC", batch_size=2)
+        return updated, [habit async for habit in habits.find({}, {"reminder_timezone": 1, "reminder_offset": 1})]
+    
+    updated, habits = asyncio.run(run())
+    
+    assert updated == 5
+    assert all(habit["reminder_timezone"] == "UTC" and habit["reminder_offset"] == 0 for habit in habits)
+
+def test_hourly_offset_refresh_runs_in_one_worker(monkeypatch):
+    from scheduler import ReminderScheduler
+    
+    refreshes = []
+    
+    async def counted_refresh():
+        refreshes.append(True)
+        return 0
+    
+    monkeypatch.setattr(Database, "refresh_reminder_offsets", staticmethod(counted_refresh))
+    hour = datetime(2024, 3, 31, 2, 0)
+    
+    async def run():
+        workers = [ReminderScheduler(), ReminderScheduler()]
+        await asyncio.gather(*(worker.refresh_offsets(hour) for worker in workers))
+        await workers[0].refresh_offsets(hour + timedelta(hours=1))
+    
+    asyncio.run(run())
+    
+    assert len(refreshes) == 2
+
+def test_update_completion_writes_the_bitmap_and_stats_in_bitmap_mode(monkeypatch):
+    bit_operations = []
+    
+    async def update_bitmap(habit_id, user_id, date_str, bit_operation):
+        # mongomock has no $bit, so the bitmap write itself is recorded instead
+        bit_operations.append((habit_id, date_str, bit_operation))
+        return bit_operation == "or"
+    
+    monkeypatch.setattr(Database, "completion_storage", "bitmap")
+    monkeypatch.setattr(Database, "_update_bitmap", staticmethod(update_bitmap))
+    today = date.today().isoformat()
+    
+    async def run():
+        await Database.get_collection('users').insert_one({"_id": "u1", "data_version": 0})
+        await Database.get_collection('habit_stats').insert_one({
+            "_id": "h1", "user_id": "u1", "last_completed_date": None, "current_run": 0,
+            "longest_streak": 0, "total_completions": 0, "recent_dates": [], "revision": 1
+        })
+        await Database.update_completion("h1", "u1", today, True)
+        checked = await Database.get_collection('habit_stats').find_one({"_id": "h1"})
+        await Database.update_completion("h1", "u1", today, False)
+        unchecked = await Database.get_collection('habit_stats').find_one({"_id": "h1"})
+        completions = await Database.get_collection('completions').count_documents({})
+        return checked, unchecked, completions
+    
+    checked, unchecked, completions = asyncio.run(run())
+    
+    assert bit_operations == [("h1", today, "or"), ("h1", today, "and")]
+    assert checked["total_completions"] == 1 and checked["recent_dates"] == [today]
+    assert unchecked["total_completions"] == 0 and unchecked["recent_dates"] == []
+    assert completions == 0
+
+def test_migration_rerun_only_replays_completions_written_since_the_last_run(monkeypatch):
+    get_collection = Database.get_collection.__func__
+    migrated_days = []
+    
+    class RecordedBitmaps:
+        # mongomock has no $bit, so the migrated operations are recorded instead
+        async def bulk_write(self, operations, ordered=True):
+            migrated_days.extend(operation._filter["_id"] for operation in operations)
+    
+    def recording_get_collection(cls, name):
+        return RecordedBitmaps() if name == 'completion_bitmaps' else get_collection(cls, name)
+    
+    monkeypatch.setattr(Database, "get_collection", classmethod(recording_get_collection))
+    written = datetime.utcnow() - timedelta(days=1)
+    
+    async def run():
+        completions = Database.get_collection('completions')
+        await completions.insert_one(
+            {"habit_id": "h1", "user_id": "u1", "date": "2024-01-01", "completed": True, "created_at": written}
+        )
+        first = await Database.migrate_completions_to_bitmaps()
+        await completions.insert_one(
+            {"habit_id": "h2", "user_id": "u1", "date": "2024-01-02", "completed": True, "created_at": datetime.utcnow()}
+        )
+        second = await Database.migrate_completions_to_bitmaps()
+        return first, second
+    
+    first, second = asyncio.run(run())
+    
+    assert (first, second) == (1, 1)
+    assert migrated_days == ["h1:2024", "h2:2024"]
@@ -0,0 +1,42 @@
+import asyncio
+import csv
+import io
+from datetime import datetime
+
+import pytest
+
+from server import accepts_gzip, export_lines
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip", True),
+    ("gzip, deflate, br", True),
+    ("GZIP;q=0.5", True),
+    ("br, *;q=0.1", True),
+    ("", False),
+    ("deflate", False),
+    ("gzip;q=0", False),
+    ("gzip; q=0.0, br", False),
+    ("br, gzip;q=0, *", False),
+    ("*;q=0", False),
+])
+def test_accepts_gzip_honours_q_values(accept_encoding, expected):
+    assert accepts_gzip(accept_encoding) is expected
+
+def test_csv_export_lists_habits_without_completions(mock_database):
+    async def run():
+        await mock_database.get_collection('habits').insert_many([
+            {"_id": "h1", "user_id": "u1", "name": "Run", "category": "health", "created_at": datetime(2024, 1, 1)},
+            {"_id": "h2", "user_id": "u1", "name": "Read", "category": "mind", "created_at": datetime(2024, 1, 2)},
+        ])
+        await mock_database.get_collection('completions').insert_one(
+            {"habit_id": "h1", "user_id": "u1", "date": "2024-01-03", "completed": True}
+        )
+        return b"".join([line async for line in export_lines("u1", "csv")]).decode()
+    
+    rows = list(csv.reader(io.StringIO(asyncio.run(run()))))
+    
+    assert rows == [
+        ["habit_id", "habit_name", "category", "date", "completed"],
+        ["h1", "Run", "health", "2024-01-03", "true"],
+        ["h2", "Read", "mind", "", ""],
+    ]
@@ -0,0 +1,15 @@
+import pytest
+from pydantic import ValidationError
+
+from models import CompletionToggle, CompletionBatchItem, CompletionBatchRequest
+
+def test_completion_dates_accept_calendar_dates():
+    assert CompletionToggle(date="2024-02-29").date == "2024-02-29"
+    assert CompletionBatchItem(habit_id="h1", date="2024-12-31", completed=True).date == "2024-12-31"
+
+@pytest.mark.parametrize("value", ["2024-02-30", "2023-02-29", "2024-13-01", "20240101", "2024-1-01", "", "today"])
+def test_completion_dates_reject_invalid_values(value):
+    with pytest.raises(ValidationError):
+        CompletionToggle(date=value)
+    with pytest.raises(ValidationError):
+        CompletionBatchRequest(items=[{"habit_id": "h1", "date": value, "completed": True}])
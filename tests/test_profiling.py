@@ -0,0 +1,25 @@
+import sys
+import threading
+import time
+
+from profiling import StackSampler
+
+def busy_root(sampler: StackSampler, seconds: float):
+    root = sys._getframe()
+    sampler.start(root, threading.get_ident())
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+    return sampler.stop(root)
+
+def test_stop_returns_a_snapshot_the_sampler_no_longer_updates():
+    sampler = StackSampler(0.001)
+    
+    samples = busy_root(sampler, 0.2)
+    total = sum(samples.values())
+    time.sleep(0.05)
+    
+    assert total > 0
+    assert sum(samples.values()) == total
+    assert all("busy_root" not in stack for stack in samples)
+    assert sampler.roots == {}
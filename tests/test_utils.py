@@ -0,0 +1,179 @@
+import random
+from datetime import date, timedelta
+from typing import List, Dict, Any
+
+import pytest
+
+from utils import (
+    calculate_current_streak, calculate_completion_rate, summarize_completion_history, streak_from_run,
+    update_completion_summary
+)
+
+# Reference implementations from before the linear-time kernels; the kernels must agree with them
+def reference_current_streak(completions: List[Dict[str, Any]], today_date: date = None) -> int:
+    if not completions:
+        return 0
+    
+    if today_date is None:
+        today_date = date.today()
+    
+    sorted_completions = sorted(completions, key=lambda x: x["date"], reverse=True)
+    
+    streak = 0
+    current_date = today_date
+    
+    today_completed = any(
+        comp["date"] == today_date.isoformat() and comp["completed"]
+        for comp in completions
+    )
+    
+    if not today_completed:
+        current_date = today_date - timedelta(days=1)
+    
+    for i in range(len(sorted_completions)):
+        date_str = current_date.isoformat()
+        
+        completion = next(
+            (comp for comp in sorted_completions if comp["date"] == date_str),
+            None
+        )
+        
+        if completion and completion["completed"]:
+            streak += 1
+            current_date -= timedelta(days=1)
+        else:
+            break
+    
+    return streak
+
+def reference_completion_rate(completions: List[Dict[str, Any]], days: int = 30) -> float:
+    if not completions or days <= 0:
+        return 0.0
+    
+    today = date.today()
+    completed_count = 0
+    
+    for i in range(days):
+        check_date = today - timedelta(days=i)
+        date_str = check_date.isoformat()
+        
+        completed = any(
+            comp["date"] == date_str and comp["completed"]
+            for comp in completions
+        )
+        
+        if completed:
+            completed_count += 1
+    
+    return round((completed_count / days) * 100, 1)
+
+def random_completions(rng: random.Random, today: date) -> List[Dict[str, Any]]:
+    """A shuffled history around today: dense runs, gaps, duplicate dates, unchecked and future days"""
+    completions = []
+    day = today + timedelta(days=rng.randint(-3, 3))
+    for _ in range(rng.randint(0, 80)):
+        completions.append({"date": day.isoformat(), "completed": rng.random() < 0.8})
+        if rng.random() < 0.1:
+            completions.append({"date": day.isoformat(), "completed": rng.random() < 0.5})
+        day -= timedelta(days=1 if rng.random() < 0.85 else rng.randint(2, 10))
+    rng.shuffle(completions)
+    return completions
+
+SEEDS = range(300)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_current_streak_matches_reference(seed):
+    rng = random.Random(seed)
+    today = date(2024, 1, 1) + timedelta(days=rng.randint(0, 1000))
+    completions = random_completions(rng, today)
+    
+    assert calculate_current_streak(completions, today) == reference_current_streak(completions, today)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_completion_rate_matches_reference(seed):
+    rng = random.Random(seed)
+    today = date.today()
+    completions = random_completions(rng, today)
+    days = rng.choice([0, 1, 7, 30, 90, 365, rng.randint(-5, 400)])
+    
+    assert calculate_completion_rate(completions, days, today) == reference_completion_rate(completions, days)
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_streak_from_summary_matches_reference(seed):
+    rng = random.Random(seed)
+    today = date(2024, 1, 1) + timedelta(days=rng.randint(0, 1000))
+    completions = random_completions(rng, today)
+    
+    # Materialized stats only see days whose stored row is completed (the first row for a date)
+    status_by_date = {}
+    for comp in completions:
+        status_by_date.setdefault(comp["date"], comp["completed"])
+    completed_dates = sorted(date_str for date_str, completed in status_by_date.items() if completed)
+    rows = [{"date": date_str, "completed": True} for date_str in completed_dates]
+    summary = summarize_completion_history(completed_dates)
+    
+    assert streak_from_run(summary["last_completed_date"], summary["current_run"], today, completed_dates) == (
+        reference_current_streak(rows, today)
+    )
+
+@pytest.mark.parametrize("seed", range(1000))
+def test_completion_summary_update_matches_full_summary(seed):
+    rng = random.Random(seed)
+    today = date(2024, 1, 1) + timedelta(days=rng.randint(0, 1000))
+    window_days = rng.choice([5, 20, 366])
+    recent_start = (today - timedelta(days=window_days - 1)).isoformat()
+    history_days = window_days + rng.randint(0, 40)
+    density = rng.random()
+    completed_dates = {
+        (today + timedelta(days=2 - offset)).isoformat()
+        for offset in range(history_days)
+        if rng.random() < density
+    }
+    summary = summarize_completion_history(sorted(completed_dates))
+    # Stored documents can still hold dates that have since left the window
+    stale = sorted(date_str for date_str in completed_dates if date_str < recent_start)[-rng.randint(0, 3):]
+    summary["recent_dates"] = stale + sorted(date_str for date_str in completed_dates if date_str >= recent_start)
+    
+    date_str = (today + timedelta(days=2 - rng.randint(0, history_days))).isoformat()
+    completed = rng.random() < 0.5
+    updated = update_completion_summary(summary, date_str, completed, recent_start)
+    
+    if updated is None:
+        return
+    if updated == {}:
+        assert (date_str in completed_dates) == completed
+        return
+    new_dates = completed_dates | {date_str} if completed else completed_dates - {date_str}
+    expected = summarize_completion_history(sorted(new_dates))
+    expected["recent_dates"] = sorted(date_str for date_str in new_dates if date_str >= recent_start)
+    assert updated == expected
+
+def test_streak_counts_back_from_today_when_later_days_are_completed():
+    today = date(2024, 6, 15)
+    run = [(today - timedelta(days=offset)).isoformat() for offset in range(1, 11)]
+    tomorrow = (today + timedelta(days=1)).isoformat()
+    completed_dates = sorted(run + [tomorrow])
+    summary = summarize_completion_history(completed_dates)
+    
+    assert summary["current_run"] == 1
+    assert streak_from_run(summary["last_completed_date"], summary["current_run"], today, completed_dates) == 10
+
+def test_summary_skips_invalid_dates():
+    summary = summarize_completion_history(["2024-02-28", "2024-02-29", "2024-02-30", "2024-03-01", "bad"])
+    
+    assert summary == {
+        "last_completed_date": "2024-03-01",
+        "current_run": 3,
+        "longest_streak": 3,
+        "total_completions": 3
+    }
+
+def test_completion_rate_of_full_year():
+    today = date.today()
+    completions = [
+        {"date": (today - timedelta(days=offset)).isoformat(), "completed": True}
+        for offset in range(3 * 365)
+    ]
+    
+    assert calculate_completion_rate(completions, 365, today) == 100.0
+    assert calculate_current_streak(completions, today) == 3 * 365